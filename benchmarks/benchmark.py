@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite covering every stage of the pipeline.
+
+Every scenario is a fixed generator file (benchmarks/generators) and a program
+length, and is run in a fresh process with fixed seeds, so runs are comparable.
+Each stage is timed separately, and the whole pipeline end to end:
+
+    expand      TemplateHandler: load generators & create instruction objects
+    index       Building the InstructionIndex
+    find        Code.find_writable_set
+    select      Code.select_instruction
+    precompile  Code.write_instruction (Instruction.precompile & scope updates)
+    compile     Compiler.compile
+    end_to_end  Code.write, finalize & Compiler.compile, programs/s & lines/s
+
+Usage, from the root of the repository:
+
+    python -m benchmarks.benchmark --output results.json
+    python -m benchmarks.benchmark --baseline results.json
+"""
+
+from src.template_handler.template_handler import TemplateHandler
+from src.code.code import Code
+from src.code.instruction_index import InstructionIndex
+from src.compiler.compiler import Compiler
+
+import argparse
+import json
+import multiprocessing
+import numpy as np
+import os
+import platform
+import resource
+import sys
+import time
+
+GENERATORS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "generators")
+
+# Generator files, from few to many templates.
+GENERATORS = ["small", "medium", "large"]
+
+# Program lengths: None lets the writer decide when to end, as in normal use.
+# A number keeps writing until the program has (at least) that many lines.
+LENGTHS = [None, 200]
+
+# Metrics where a higher value is better, all others are times where lower is better.
+HIGHER_IS_BETTER = ["programs_per_second", "lines_per_second"]
+
+
+def write_program(code, length, timings):
+    """
+    Write a program one step at a time, timing each stage.
+    Without a length this is the same as Code.write().
+    """
+    while True:
+        # Ending is only a candidate once the program is long enough,
+        # so every step writes an instruction until then.
+        allow_end = length == None or len(code.written_instructions) >= length
+
+        start = time.perf_counter()
+        writable_ids, features = code.find_writable_set()
+        selected = time.perf_counter()
+        instruction = code.select_instruction(writable_ids, features, allow_end)
+        end = time.perf_counter()
+
+        timings["find"] += selected - start
+        timings["select"] += end - selected
+
+        if instruction == None:
+            break
+
+        start = time.perf_counter()
+        code.write_instruction(instruction)
+        timings["precompile"] += time.perf_counter() - start
+
+
+def run_scenario(generator, length, programs, repeat, seed):
+    """
+    Run a single scenario and return its results.
+    Every stage is run repeat times, and the fastest run is kept.
+    """
+    path = os.path.join(GENERATORS_DIRECTORY, generator + ".txt")
+
+    best = {}
+    def keep_best(name, value):
+        best[name] = min(best.get(name, value), value)
+
+    for _ in range(repeat):
+        # Expansion of the generators.
+        start = time.perf_counter()
+        handler = TemplateHandler()
+        handler.load_template_generators(path)
+        instructions = handler.create_instructions()
+        keep_best("expand", time.perf_counter() - start)
+
+        start = time.perf_counter()
+        index = InstructionIndex(instructions)
+        keep_best("index", time.perf_counter() - start)
+
+        # Writing, stage by stage.
+        timings = {"find": 0.0, "select": 0.0, "precompile": 0.0}
+        codes = []
+        for number in range(programs):
+            code = Code(instructions, index, rng=np.random.default_rng([seed, number]))
+            write_program(code, length, timings)
+            code.finalize()
+            codes.append(code)
+
+        for name, value in timings.items():
+            keep_best(name, value)
+
+        compiler = Compiler()
+        start = time.perf_counter()
+        for code in codes:
+            compiler.compile(code)
+        keep_best("compile", time.perf_counter() - start)
+
+        nr_lines = sum(len(code.written_instructions) for code in codes)
+
+        # End to end, the way programs are normally written.
+        compiler = Compiler()
+        start = time.perf_counter()
+        for number in range(programs):
+            code = Code(instructions, index, rng=np.random.default_rng([seed, number]))
+            if length == None:
+                code.write()
+            else:
+                write_program(code, length, {"find": 0.0, "select": 0.0, "precompile": 0.0})
+            code.finalize()
+            compiler.compile(code)
+        keep_best("end_to_end", time.perf_counter() - start)
+
+    return {
+        "generator": generator,
+        "length": length,
+        "programs": programs,
+        "templates": len(instructions),
+        "lines": nr_lines,
+        "seconds": best,
+        "programs_per_second": programs / best["end_to_end"],
+        "lines_per_second": nr_lines / best["end_to_end"],
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def scenario_name(result):
+    return result["generator"] + "/" + ("natural" if result["length"] == None else str(result["length"]))
+
+
+def run(generators, lengths, programs, repeat, seed):
+    """
+    Run all scenarios, each in a fresh process so peak RSS is measured per scenario.
+    """
+    context = multiprocessing.get_context("spawn")
+
+    results = []
+    for generator in generators:
+        for length in lengths:
+            with context.Pool(1) as pool:
+                result = pool.apply(run_scenario, (generator, length, programs, repeat, seed))
+
+            print_result(result)
+            results.append(result)
+
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "seed": seed,
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def print_result(result):
+    stages = "  ".join(name + " " + format(seconds * 1000, ".1f") + "ms" for name, seconds in result["seconds"].items())
+    print(format(scenario_name(result), "<16"), format(result["programs_per_second"], ".1f"), "programs/s ",
+        format(result["lines_per_second"], ".0f"), "lines/s ", str(result["peak_rss_kb"] // 1024) + "MB ", stages)
+
+
+def compare(report, baseline, tolerance):
+    """
+    Compare a report against a baseline report.
+    Prints the change of every metric and returns the names of all regressions.
+    """
+    baseline_results = {scenario_name(result): result for result in baseline["results"]}
+
+    regressions = []
+    for result in report["results"]:
+        name = scenario_name(result)
+        if name not in baseline_results:
+            continue
+
+        base = baseline_results[name]
+        metrics = [(stage, result["seconds"][stage], base["seconds"].get(stage)) for stage in result["seconds"]]
+        metrics += [(metric, result[metric], base.get(metric)) for metric in HIGHER_IS_BETTER]
+
+        changes = []
+        for metric, value, base_value in metrics:
+            if base_value == None or base_value == 0:
+                continue
+
+            # Positive change is always an improvement.
+            if metric in HIGHER_IS_BETTER:
+                change = value / base_value - 1
+            else:
+                change = base_value / value - 1
+
+            changes.append(metric + " " + format(change * 100, "+.0f") + "%")
+            if change < -tolerance:
+                regressions.append(name + " " + metric)
+
+        print(format(name, "<16"), "  ".join(changes))
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the pipeline.")
+    parser.add_argument("--generators", nargs="+", choices=GENERATORS, default=GENERATORS, help="Generator files to benchmark.")
+    parser.add_argument("--lengths", nargs="+", type=int, default=None, help="Program lengths to benchmark, in addition to natural length.")
+    parser.add_argument("--programs", type=int, default=50, help="Number of programs per scenario.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs per scenario, the fastest is kept.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the programs.")
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", default=None, help="Compare the results to this JSON file.")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative slowdown compared to the baseline that counts as a regression.")
+    args = parser.parse_args()
+
+    lengths = LENGTHS if args.lengths == None else [None] + args.lengths
+
+    report = run(args.generators, lengths, args.programs, args.repeat, args.seed)
+
+    if args.output != None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline != None:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+
+        print()
+        regressions = compare(report, baseline, args.tolerance)
+        if len(regressions) > 0:
+            print("Regressions:", ", ".join(regressions))
+            sys.exit(1)
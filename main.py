@@ -1,46 +1,150 @@
 #!/usr/bin/env python3
 
+from src.template_handler.template_cache import TemplateCache
 from src.template_handler.template_handler import TemplateHandler
 from src.code.code import Code
 from src.compiler.compiler import Compiler
+from src.batch.batch import BatchGenerator
+from src.code.program_archive import ProgramArchiveWriter
+from src.instrumentation.tracer import Tracer, LEVELS, INFO
+from src.instrumentation.profiler import Profiler
 
+import argparse
+import numpy as np
+import os
 
 
-###
-# Load Generators & Generate Templates.
-# Then create instruction objects.
-###
-th = TemplateHandler()
-th.load_template_generators("template_generators/main.txt")
-th.generate_templates()
-th.save_templates("templates/main.tmpl")
+def write_single(tracer, seed, profile_path=None, use_masks=True, sample=None):
+    """
+    Write a single program to out.pytmpl and compile it to out.py.
+    With sample, the program is written with that many templates sampled
+    uniformly from all permutations of the generators, which are never expanded.
+    """
+    profiler = Profiler() if profile_path != None else None
+    rng = np.random.default_rng(seed)
 
-available_instructions = th.create_instructions("templates/main.tmpl")
+    ###
+    # Load Generators & Generate Templates.
+    # Then create instruction objects.
+    # Templates are only generated when the generators have changed since last run.
+    ###
+    if sample == None:
+        cache = TemplateCache("templates/cache")
+        available_instructions = cache.load_instructions("template_generators/main.txt")
 
-# for ins in available_instructions:
-# 	print(ins.template)
+        if tracer.level >= INFO:
+            tracer.log(cache.report())
 
-###
-# Write Code & Pre-compile
-###
-code = Code(available_instructions)
-# code.load_from_file("function-header.pytmpl")
+    else:
+        th = TemplateHandler()
+        th.load_template_generators("template_generators/main.txt")
+        available_instructions = th.create_sampled_instructions(sample, rng)
 
-# code.write_function()
-code.write()
+        if tracer.level >= INFO:
+            tracer.log("Sampled", len(available_instructions) - 1, "of", th.count_templates(), "templates")
 
-code.finalize()
+    # for ins in available_instructions:
+    # 	print(ins.template)
 
-# for instruction in code.written_instructions:
-# 	print(str(instruction))
+    ###
+    # Write Code & Pre-compile
+    ###
+    code = Code(available_instructions, tracer=tracer, rng=rng, profiler=profiler)
+    code.use_masks = use_masks
+    # code.load_from_file("function-header.pytmpl")
 
-code.save_to_file("out.pytmpl")
+    # Compile to Python3 while writing, so it is done as soon as the code is.
+    compiler = Compiler(profiler=profiler)
+    compiled_code = compiler.stream(code)
 
-###
-# Compile to Pyhton3
-###
-compiler = Compiler()
-compiled_lines = compiler.compile_and_write(code, "out.py")
+    # code.write_function()
+    try:
+        code.write()
+    except Exception:
+        # Show the last decisions leading up to the error.
+        tracer.dump()
+        raise
 
-# for line in compiled_lines:
-#     print(line)
+    if tracer.level >= INFO:
+        if use_masks:
+            tracer.log("Writable set cache:", code.index.writable_sets.info())
+        else:
+            for check_stats in code.index.checks.report():
+                tracer.log("Check:", check_stats)
+
+    code.finalize()
+
+    # for instruction in code.written_instructions:
+    # 	print(str(instruction))
+
+    code.save_to_file("out.pytmpl")
+
+    ###
+    # Write the Pyhton3 code
+    ###
+    compiled_lines = compiled_code.lines
+    compiler.write(compiled_lines, "out.py")
+
+    if tracer.level >= INFO:
+        tracer.log("Compiler cache:", compiler.cache_info())
+
+    if profiler != None:
+        profiler.dump(profile_path)
+
+    # for line in compiled_lines:
+    #     print(line)
+
+
+def write_batch(count, workers, seed, out_dir, archive_path=None, profile_path=None):
+    """
+    Write count programs across a pool of worker processes.
+    Each program is saved as out_dir/programN.pytmpl & out_dir/programN.py,
+    or only pre-compiled into a single program archive if given an archive path.
+    """
+    generator = BatchGenerator("template_generators/main.txt", "templates/cache", workers, profile=profile_path != None)
+
+    if archive_path != None:
+        with ProgramArchiveWriter(archive_path) as writer:
+            for program in generator.generate(count, seed):
+                writer.add_program(program.pre_compiled_lines)
+
+    else:
+        os.makedirs(out_dir, exist_ok=True)
+
+        for program in generator.generate(count, seed):
+            path = os.path.join(out_dir, "program" + str(program.number))
+            program.save(path + ".pytmpl", path + ".py")
+
+    if profile_path != None:
+        generator.profiler.dump(profile_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate Python3 programs.")
+    parser.add_argument("--count", type=int, default=None, help="Number of programs to generate in batch mode.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes in batch mode. Defaults to the number of CPUs.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for reproducible output.")
+    parser.add_argument("--out-dir", default="out", help="Output directory for batch mode.")
+    parser.add_argument("--archive", default=None, metavar="PATH", help="Write the pre-compiled programs of batch mode to a single program archive instead.")
+    parser.add_argument("--trace", choices=LEVELS.keys(), default="off", help="Print writing decisions up to this level.")
+    parser.add_argument("--profile", default=None, metavar="PATH", help="Write per-phase timings & counters as JSON to this file.")
+    parser.add_argument("--checks", action="store_true", help="Find writable instructions with the check pipeline instead of bitmasks, reporting per-check stats at info level.")
+    parser.add_argument("--sample", type=int, default=None, metavar="N", help="Write with N templates sampled from all permutations of the generators, without expanding them.")
+    parser.add_argument("--trace-buffer", type=int, default=0, metavar="N", help="Keep the last N writing decisions (at debug level, unless --trace is given) and show them if writing fails.")
+    args = parser.parse_args()
+
+    # Options of single program mode, which batch mode does not support.
+    if args.count != None:
+        for option, value, default in [("--sample", args.sample, None), ("--checks", args.checks, False), ("--trace", args.trace, "off"), ("--trace-buffer", args.trace_buffer, 0)]:
+            if value != default:
+                parser.error(option + " is not supported in batch mode (--count).")
+
+    if args.count == None:
+        level = LEVELS[args.trace]
+        if args.trace_buffer > 0 and args.trace == "off":
+            level = LEVELS["debug"]
+
+        tracer = Tracer(level, echo=args.trace != "off", buffer_size=args.trace_buffer)
+        write_single(tracer, args.seed, args.profile, not args.checks, args.sample)
+    else:
+        write_batch(args.count, args.workers, args.seed, args.out_dir, args.archive, args.profile)
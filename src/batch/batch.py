@@ -0,0 +1,131 @@
+from src.template_handler.template_cache import TemplateCache
+from src.code.code import Code
+from src.code.instruction_index import InstructionIndex
+from src.compiler.compiler import Compiler
+from src.instrumentation.profiler import Profiler
+
+import multiprocessing
+import numpy as np
+
+# Per worker process state, set up once by init_worker().
+worker_state = {}
+
+
+class GeneratedProgram():
+    """
+    A single generated program, both pre-compiled and compiled.
+    """
+    def __init__(self, number, pre_compiled_lines, compiled_lines):
+        self.number = number                          # Position of the program in the batch
+        self.pre_compiled_lines = pre_compiled_lines  # Lines of pre-compiled code, same as Code.save_to_file()
+        self.compiled_lines = compiled_lines          # Lines of Python3 code, same as Compiler.compile()
+
+
+    def save(self, pre_compiled_path, compiled_path):
+        """
+        Write the pre-compiled and compiled program to file.
+        """
+        with open(pre_compiled_path, "w") as file:
+            for line in self.pre_compiled_lines:
+                file.write(line + "\n")
+
+        with open(compiled_path, "w") as file:
+            for line in self.compiled_lines:
+                file.write(line + "\n")
+
+
+class BatchGenerator():
+    """
+    Generate many programs across a pool of worker processes.
+
+    Templates are generated once by the parent into the template cache,
+    and loaded once per worker from the cache.
+    Programs are handed out in chunks, and every chunk is seeded with its own
+    independent seed spawned from the batch seed, so a batch is reproducible
+    regardless of the number of workers.
+
+    When profiling, every chunk is profiled on its own and merged into self.profiler.
+    """
+
+    def __init__(self, generators_path, cache_directory="templates/cache", workers=None, chunk_size=64, profile=False):
+        self.generators_path = generators_path
+        self.cache_directory = cache_directory
+        self.workers = workers if workers != None else multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        self.profiler = Profiler() if profile else None
+
+
+    def generate(self, count, seed=None):
+        """
+        Generate count programs. Yields GeneratedProgram objects in order as they are completed.
+        """
+        # Make sure the cache is warm before the workers start.
+        TemplateCache(self.cache_directory).load_instructions(self.generators_path)
+
+        # One independent seed per chunk.
+        chunks = []
+        seeds = np.random.SeedSequence(seed).spawn((count + self.chunk_size - 1) // self.chunk_size)
+        for i, chunk_seed in enumerate(seeds):
+            first_number = i * self.chunk_size
+            chunks.append((first_number, min(self.chunk_size, count - first_number), chunk_seed))
+
+        profile = self.profiler != None
+
+        # Generate in this process when only using one worker.
+        if self.workers == 1:
+            init_worker(self.generators_path, self.cache_directory, profile)
+            for chunk in chunks:
+                programs, profile_data = generate_chunk(chunk)
+                if profile:
+                    self.profiler.merge(profile_data)
+                yield from programs
+            return
+
+        with multiprocessing.Pool(self.workers, initializer=init_worker, initargs=(self.generators_path, self.cache_directory, profile)) as pool:
+            for programs, profile_data in pool.imap(generate_chunk, chunks):
+                if profile:
+                    self.profiler.merge(profile_data)
+                yield from programs
+
+
+def init_worker(generators_path, cache_directory, profile=False):
+    """
+    Load the instructions and build the instruction index once per worker.
+    """
+    instructions = TemplateCache(cache_directory).load_instructions(generators_path)
+
+    worker_state['instructions'] = instructions
+    worker_state['index'] = InstructionIndex(instructions)
+    worker_state['compiler'] = Compiler()
+    worker_state['profile'] = profile
+
+
+def generate_chunk(chunk):
+    """
+    Generate a chunk of programs, given as (first program number, count, seed sequence).
+    Returns a list of GeneratedProgram objects, and the profile of the chunk
+    as a dict (see Profiler.to_dict()) or None when not profiling.
+    """
+    first_number, count, seed_sequence = chunk
+
+    rng = np.random.default_rng(seed_sequence)
+
+    profiler = Profiler() if worker_state['profile'] else None
+    worker_state['compiler'].profiler = profiler
+
+    programs = []
+    for number in range(first_number, first_number + count):
+        code = Code(worker_state['instructions'], worker_state['index'], rng=rng, profiler=profiler)
+        compiled_code = worker_state['compiler'].stream(code)
+        code.write()
+        code.finalize()
+
+        pre_compiled_lines = [str(instruction) for instruction in code.written_instructions]
+        compiled_lines = compiled_code.lines
+
+        programs.append(GeneratedProgram(number, pre_compiled_lines, compiled_lines))
+
+    if profiler != None:
+        return programs, profiler.to_dict()
+
+    return programs, None
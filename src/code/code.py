@@ -1,19 +1,54 @@
 from src.code.elements.instruction import Instruction
 from src.code.elements.scope import Scope
 from src.code.elements.function import Function
-
+from src.code.elements.token import lex
+from src.code.instruction_index import InstructionIndex
+from src.code.program_columns import ProgramColumnsBuilder
+from src.code.writability_checks import WritabilityChecks
+from src.instrumentation.tracer import Tracer, INFO, DEBUG, TRACE
+from src.instrumentation.profiler import FIND, SELECT, PRECOMPILE, WRITABLE_SET_SIZE, PROGRAM_LENGTH
+
+import copy
 import numpy as np
-import random
-import re
+import time
 
 MAX_INDENDT = 5
 
+# Limit on the number of written instructions, in case the loaded instructions
+# can never finish the code (ex: a def without any return). Past the limit, the
+# code is ended as soon as it is endable, and writing fails if that does not
+# happen within MAX_OVERRUN more instructions.
+MAX_INSTRUCTIONS = 1000
+MAX_OVERRUN = 100
+
 class Code():
 
-    def __init__(self, available_instructions):
+    def __init__(self, available_instructions, index=None, tracer=None, rng=None, profiler=None):
         self.scope = Scope()                                 # Currently scoped dynamic elements & other scope related stuff
         self.available_instructions = available_instructions # All loaded instruction objects
+        self.index = index                                   # Loaded instructions grouped by their requirements
         self.written_instructions = []                       # Completed lines of code, represented as Instruction objects
+        self.tracer = tracer if tracer != None else Tracer() # Tracing of writing decisions, disabled by default
+        self.rng = rng if rng != None else np.random.default_rng() # All random decisions are drawn from this numpy Generator
+        self.listeners = []                                  # Callbacks called with each instruction as it is written
+        self.profiler = profiler                             # Per-phase timing & counters, None when disabled
+        self.scope.profiler = profiler
+        self.use_masks = True                                # Find writable instructions with bitmasks, or group by group
+
+        # Building the index is only done once, it can be shared between Code objects.
+        if self.index == None:
+            self.index = InstructionIndex(available_instructions)
+
+        if self.index.checks == None:
+            self.index.checks = WritabilityChecks(MAX_INDENDT)
+
+
+    def subscribe(self, listener):
+        """
+        Call listener with every instruction written from now on, once it is completed.
+        Listeners are not carried over to forks, and are not told about rollbacks.
+        """
+        self.listeners.append(listener)
 
 
     def write_function(self):
@@ -28,36 +63,63 @@ class Code():
         Write instructions untill the program is deemed finished.
         """
 
+        profiler = self.profiler
+
         while True:
 
+            if profiler != None:
+                start = time.perf_counter()
+
             # Find all currently writable instructions
-            writable_instructions = self.find_writable_instructions()        
+            writable_ids, features = self.find_writable_set()
+
+            if profiler != None:
+                found = time.perf_counter()
+                profiler.add(FIND, found - start)
+                profiler.record(WRITABLE_SET_SIZE, len(writable_ids))
 
             # DEBUG            
-            # for ins in writable_instructions:
-            #     print(ins.template)
+            # for template_id in writable_ids:
+            #     print(self.index.templates[template_id])
 
             # Select one
-            selected_instruction = self.select_instruction(writable_instructions)
+            selected_instruction = self.select_instruction(writable_ids, features)
+
+            if profiler != None:
+                profiler.add(SELECT, time.perf_counter() - found)
             
             # If the writer determines code to be finished.
             if selected_instruction == None:
                 break
 
-            print("Selecting Instruction(" + str(len(self.written_instructions)+1) + "):", selected_instruction.template)
+            if len(self.written_instructions) >= MAX_INSTRUCTIONS:
+                if self.is_endable():
+                    if self.tracer.level >= INFO:
+                        self.tracer.log("Stopping at the max number of instructions:", len(self.written_instructions))
+                    break
+
+                if len(self.written_instructions) >= MAX_INSTRUCTIONS + MAX_OVERRUN:
+                    raise Exception("Code: Could not finish the code within " + str(MAX_INSTRUCTIONS + MAX_OVERRUN) + " instructions.")
+
+            if self.tracer.level >= INFO:
+                self.tracer.log("Selecting Instruction(" + str(len(self.written_instructions)+1) + "):", selected_instruction.parsed_template)
 
             # Complete the instruction and add it to written instructions
             self.write_instruction(selected_instruction)
-            print("Pre-compiled Instruction:", selected_instruction.pre_compiled_elements)
-            print("\n")
+
+            if self.tracer.level >= INFO:
+                self.tracer.log("Pre-compiled Instruction:", selected_instruction.pre_compiled_elements)
 
             # Handle specific stopping points.
             if special == "single-function" and len(self.written_instructions) > 0:
-                if self.written_instructions[-1].template[0] == "return":
+                if self.written_instructions[-1].parsed_template.is_return:
                     break
 
             # DEBUG
-            # print("Instruction Count:", len(self.written_instructions), "Num Funcs", self.scope.funcs['num_created'], "Current Indent:", self.scope.indent)
+            # print("Instruction Count:", len(self.written_instructions), "Num Funcs", self.scope.num_created_funcs, "Current Indent:", self.scope.indent)
+
+        if profiler != None:
+            profiler.record(PROGRAM_LENGTH, len(self.written_instructions))
 
 
     def write_instruction(self, instruction):
@@ -69,125 +131,110 @@ class Code():
         # Set the indentation of the line
         instruction.indent = self.scope.indent
 
+        if self.profiler != None:
+            start = time.perf_counter()
+
         # Fill out dynamic elements and lock in the instruction to complete it.
         # Then update the current scope with variable/scope changes.
         completed_instruction = self.precompile_instruction(instruction)
 
+        if self.profiler != None:
+            self.profiler.add(PRECOMPILE, time.perf_counter() - start)
+
         # Finally add the completed instruction as a line of code.
         self.written_instructions.append(completed_instruction)
 
+        for listener in self.listeners:
+            listener(completed_instruction)
+
 
     def finalize(self):
         """
         When the code is complete, remove unnecessary stuff.
         """
         self.available_instructions = None
+        self.index = None
         self.scope = None
 
 
     def find_writable_instructions(self):
         """
-        Go through all avaialbe(loaded) instructions and see which are able to
-        be written in the current state.
+        Find all instructions that are able to be written in the current state.
+        Returns an array with the template ids of the writable instructions.
+        No instruction objects are created until one has been selected.
         """
+        return self.find_writable_set()[0]
 
-        # TODO: Order the checks so that the fastest ones are completed first for optimization.
 
-        writable_instructions = []
-        
-        # Check the requirements for each instruction to be written to determine
-        # which instructions are currently writable.
-        # Continue to next instruction if any requirement is missing.
-        for instruction in self.available_instructions:
-
-            # Check -1:
-            # If the function has return in the first indentation level of the body, you have to call nlb.
-            # Otherwise the code will be unreachable.
-            # And...
-            # Do not return in void-function
-            # AND...
-            # Do not return on any other indent rather than the most inner body indent. 
-            if self.scope.in_function != None:    
-                if self.scope.indent == self.scope.in_function.indent + 1:
-                    if self.written_instructions[-1].template[0] == "return" and instruction.template[0] != "nlb":
-                        continue
-
-                if instruction.template[0] == "return":
-                    if self.scope.in_function.return_type == "void":
-                        continue
-
-                    if self.scope.indent != self.scope.in_function.indent + 1:
-                        continue
-
-            # Check 0:
-            # Is the instruction trying to reduce indent below 0?
-            # Or is the instruction trying to reduce indent JUST AFTER statement declaration?
-            # OR... Is the instruction trying to exit non-void function before return?
-            if instruction.template[0] == "nlb":
-                if self.scope.indent == 0:
-                    continue
-                
-                if len(self.written_instructions) > 0:
-                    if self.written_instructions[-1].is_statement():
-                        continue
-
-                if self.scope.in_function != None:
-                    if self.scope.indent == self.scope.in_function.indent + 1:
-                        if not self.scope.in_function.has_returned:
-                            continue
-
-            # Check 1:
-            # Would the instruction increase current indent past MAX_INDENT?
-            if self.scope.indent == MAX_INDENDT and instruction.is_statement():
-                continue
-
-            # Check 2:
-            # Are the required dynamic elements currently present in the code?
-            requirements = instruction.get_required_elements()
-
-            element_requirements_met = True
-            for requirement in requirements:
-                if not self.requirement_is_present(requirement):
-                    element_requirements_met = False
-                    break
+    def find_writable_set(self):
+        """
+        Find all instructions that are able to be written in the current state,
+        along with their relevance features used by select_instruction().
 
-            if not element_requirements_met:
-                continue
+        The state is encoded as bits, which are compared to the precomputed
+        bitmasks of all instructions at once, see WritabilityMasks.
+        Same as check_writable_groups(), which is used when not self.use_masks.
 
-            # Check 3:
-            # Does the instruction require a function scope? In that case,
-            # are we inside of a function?
-            if instruction.must_be_in_function():
-                if self.scope.in_function == None:
-                    continue
+        The result for each state is kept in the LRU cache of the index,
+        as the same states recur constantly.
 
-            # Check 4:
-            # Don't write functions on indent above 0.
-            if instruction.template[0] == "def" and self.scope.indent != 0:
-                continue
+        Returns (template ids, (is_nlb, is_statement, is_return)) as arrays.
+        """
+        if not self.use_masks:
+            return self.index.checks.writable_set(self, self.index.groups)
 
+        last_template = None
+        if len(self.written_instructions) > 0:
+            last_template = self.written_instructions[-1].parsed_template
 
-            # All checks have been passed. Instruction is currently writable.
-            writable_instructions.append(instruction.clone())
+        masks = self.index.masks
+        state = masks.state(self.scope, last_template, MAX_INDENDT)
 
-        return writable_instructions
+        writable_set = self.index.writable_sets.get(state)
+        if writable_set == None:
+            writable_ids = masks.writable_ids(state)
+            writable_set = (writable_ids, self.index.features(writable_ids))
+            self.index.writable_sets.put(state, writable_set)
 
+        return writable_set
 
-    def select_instruction(self, writable_instructions):
+
+    def check_writable_groups(self):
         """
-        Select one of the writable instructions.
+        Go through all avaialbe(loaded) instructions and see which are able to
+        be written in the current state.
+
+        The checks are made once per group of the instruction index, since all
+        instructions in a group share the properties being checked.
+        Each check is a named predicate in the WritabilityChecks pipeline of the index.
+
+        Returns an array with the template ids of the writable instructions.
+        No instruction objects are created until one has been selected.
+        """
+
+        # The checks are ordered adaptively, see WritabilityChecks.
+        return self.index.checks.writable_set(self, self.index.groups)[0]
+
+
+    def select_instruction(self, writable_ids, features=None, allow_end=True):
+        """
+        Select one of the writable instructions, given as an array of template ids
+        and optionally their features, as returned by find_writable_set().
+        Returns a new Instruction object for the selected template,
+        or None if the code should be finished. Without allow_end, ending
+        the code is never a candidate, even when it is endable.
         """
 
         # If there are no more instruction left to write, return None to
         # finish the code. This happens if a function has return and the
         # indent has been reduced to 0 when only writing a single function.
-        if len(writable_instructions) == 0:
+        if len(writable_ids) == 0:
             return None
 
         # If there is just one avaialble instruction just return it.
         # This can happen when the only thing left avaialable is "nlb".
-        if len(writable_instructions) == 1:
-            return writable_instructions[0]
+        if len(writable_ids) == 1:
+            return Instruction(self.index.templates[writable_ids[0]])
 
         # Determine relevance of each instruction.
         # Relevance is scored from 1-100, with a baseline of 50.
@@ -198,61 +245,54 @@ class Code():
         # Score will be converted into probabilities based on each
         # instructions individual score, so a higher score means
         # a larger chance to get selected, but never 0% or 100%.
-        instruction_relevance = [50 for _ in writable_instructions]
-        
-        # If the code is currently endable, add the end instruction (None).
-        if self.is_endable():
-            instruction_relevance.append(50)
-            writable_instructions.append(None)
-
-        for i, instruction in enumerate(writable_instructions):
-            relevance = 50
-            
-            if instruction == None:
-                # TODO: there should probably be a lot more going into this decision.
-                relevance = 100
-                relevance += len(self.written_instructions) * 5
+        #
+        # The scores are computed for all candidates at once from the
+        # feature arrays of the writable set. The kinds never overlap.
+        nr_written = len(self.written_instructions)
+        indent = self.scope.indent
 
-            elif instruction.template[0] == "nlb":
-                # The higher the value of current indentation, the larger the
-                # chance to reduce indentation.
-                relevance += 10 * self.scope.indent
-                relevance += len(self.written_instructions) * 5
+        if features == None:
+            features = self.index.features(writable_ids)
 
-            elif instruction.is_statement():
-                # Reduce chance to increase indentation the higher the current indentation,
-                # when at or above indent 2.
-                if self.scope.indent > 1:
-                    relevance -= 15 * self.scope.indent
-                    relevance -= len(self.written_instructions) * 5
+        is_nlb, is_statement, is_return = features
 
-            elif instruction.template[0] == "return":
-                # The more lines in a function, the more likely to return.
-                # The option to return is only available when on the first level
-                # of indentation of the function, but all lines in the function count.
-                relevance += 5 * self.scope.nr_instructions_in_func    
+        relevance = np.full(len(writable_ids), 50, dtype=np.int64)
 
+        # The higher the value of current indentation, the larger the
+        # chance to reduce indentation.
+        relevance += is_nlb * (10 * indent + 5 * nr_written)
 
-            # Keep relevance within 1-100.
-            # instruction_relevance[i] = max(1, min(100, relevance))
-            instruction_relevance[i] = max(1, relevance)
+        # Reduce chance to increase indentation the higher the current indentation,
+        # when at or above indent 2.
+        if indent > 1:
+            relevance -= is_statement * (15 * indent + 5 * nr_written)
 
+        # The more lines in a function, the more likely to return.
+        # The option to return is only available when on the first level
+        # of indentation of the function, but all lines in the function count.
+        relevance += is_return * (5 * self.scope.nr_instructions_in_func)
 
-        # Calculate normalizer, using: (1 / (sum of relevance)).
-        normalizer = 1 / float(sum(instruction_relevance))
+        # If the code is currently endable, add the end instruction as the last candidate.
+        # TODO: there should probably be a lot more going into this decision.
+        if allow_end and self.is_endable():
+            relevance = np.append(relevance, 100 + 5 * nr_written)
 
-        # Multiply each value by the normalizer to determine probabilities.
-        probabilities = [relevance * normalizer for relevance in instruction_relevance]
+        # Keep relevance within 1-100.
+        # np.clip(relevance, 1, 100, out=relevance)
+        np.maximum(relevance, 1, out=relevance)
 
-        # Select species based on probability
-        selected_instruction = np.random.choice(writable_instructions, 1, p=probabilities)[0]
+        # Select based on probability, where each candidate covers a part of
+        # the cumulative relevance proportional to its own relevance.
+        cumulative_relevance = np.cumsum(relevance)
+        selected = np.searchsorted(cumulative_relevance, self.rng.random() * cumulative_relevance[-1], side="right")
 
-        # TODO: Already cloning all writable.. for some reason. Don't remember why.
-        # # Return a clone, as we don't want to edit the original instruction object.
-        # if selected_instruction != None:
-        #     selected_instruction = selected_instruction.clone()
+        # The end instruction was selected.
+        if selected == len(writable_ids):
+            return None
 
-        return selected_instruction
+        # Only the selected template is made into an instruction object,
+        # the templates themselves are shared and never edited.
+        return Instruction(self.index.templates[writable_ids[selected]])
 
 
     # TODO: Rename to "pre_compile" for clarity?
@@ -263,7 +303,9 @@ class Code():
         """ 
         dynamic_element_tokens = instruction.get_dynamic_element_tokens()
         element_args = []
-        print("Dynamic Elements:", dynamic_element_tokens)
+
+        if self.tracer.level >= DEBUG:
+            self.tracer.log("Dynamic Elements:", dynamic_element_tokens)
 
 
         # Find suitable elements to replace the dynamic element tokens of the instruction.
@@ -273,7 +315,7 @@ class Code():
             elements = self.get_dynamic_elements_of_type(token)
             # Select one.
             # TODO: Use some intelligence (weighted list of elements?) Similar to select_instruction()
-            selected_element = np.random.choice(elements)
+            selected_element = elements[self.rng.integers(len(elements))]
             
             # A call to a self-created function also requires the needed
             # arguments for that function.
@@ -284,7 +326,7 @@ class Code():
                     vars = self.get_dynamic_elements_of_type(dynamic_type)
 
                     # TODO: Intelligence over selection here aswell maybeeeee.
-                    argument = np.random.choice(vars)
+                    argument = vars[self.rng.integers(len(vars))]
                     arguments.append(argument)
                 
                 selected_element = [selected_element]
@@ -292,10 +334,14 @@ class Code():
 
             element_args.append(selected_element)
 
-        print("Element Replacements:", element_args)
+        if self.tracer.level >= DEBUG:
+            self.tracer.log("Element Replacements:", element_args)
 
         self.scope = instruction.precompile(element_args, self.scope)
 
+        if self.tracer.level >= TRACE:
+            self.tracer.log("Elements are now:", instruction.elements)
+
 
         return instruction
 
@@ -313,7 +359,7 @@ class Code():
             endable = False
 
         elif self.scope.in_function != None:
-            if not self.scope.in_function.has_returned:
+            if not self.scope.has_returned:
                 endable = False
 
         return endable
@@ -330,43 +376,25 @@ class Code():
         Requirement is an element token string, ex: "var<int>".
         """
         is_present = False
+        token = lex(requirement)
         
-        if requirement.startswith("var"):
-            var_type = re.findall(r"<(.*?)>", requirement)[0]
-            if len(self.scope.vars[var_type]['available']) > 0:
+        if token.kind == "var":
+            if self.scope.has_vars_of_type(token.type):
                 is_present = True
 
-        elif requirement.startswith("func"):
-            return_type = re.findall(r"func<(.*?)>", requirement)[0]
-            arg_types = re.findall(r"var<(.*?)>", requirement)
+        elif token.kind == "func":
+            arg_types = [param.type for param in token.params if param.is_variable()]
 
-            # Make sure the arguments are available
+            # Make sure the arguments are available, then look up functions with
+            # a matching signature (return type & parameter types, in order).
+            is_present = True
             for arg_type in arg_types:
-                if len(self.scope.vars[arg_type]['available']) == 0:
-                    break
-
-            for func in self.scope.funcs['available']:
-                if not len(arg_types) == len(func.param_types):
+                if not self.scope.has_vars_of_type(arg_type):
+                    is_present = False
                     break
 
-                # Correct return type (void/int/bool etc.)
-                if func.return_type != return_type:
-                    continue
-
-                # Make sure that all function parameters are matching.
-                matching_args = True
-                for i in range(len(arg_types)):
-                    if not arg_types[i] == func.param_types[i]:
-                        matching_args = False
-                        break
-                
-                if matching_args:
-                    # Don't allow function recursion.
-                    if func == self.scope.in_function:
-                        continue
-                    else:
-                        is_present = True
-                        break
+            if is_present:
+                is_present = len(self.scope.callable_funcs(token.type, arg_types)) > 0
 
         else:
             raise Exception("Trying to check for dynamic requirement of static element.")
@@ -386,52 +414,35 @@ class Code():
         Returns a list of all scoped variables of type int.
         
         Ex 2: token=func(var<int>,var<int>)
-        Returns a list of all scoped functions where there are two integer parameters.
+        Returns a list of all scoped functions where there are two integer parameters,
+        except the function currently being defined.
         """
         elements = []
+        token = lex(token)
         
-        if token.startswith("var"):
-            var_type = re.findall(r"<(.*?)>", token)[0]
-            elements = self.scope.vars[var_type]['available']
+        if token.kind == "var":
+            elements = self.scope.vars_of_type(token.type)
 
-        elif token.startswith("func"):
-            return_type = re.findall(r"func<(.*?)>", token)[0]
-            
+        elif token.kind == "func":
             # TODO: This way only variables can be passed to func.
-            # Could use re.findall(r"v\((.*)\)", token).split(",") to get all arguements of any type.
-            arg_types = re.findall(r"var<(.*?)>", token)
-
-            for func in self.scope.funcs['available']:
-                # Check for correct return type (void/int/bool etc.)
-                if func.return_type != return_type:
-                    continue
-
-                if len(arg_types) == len(func.param_types):
-                    matching_args = True
-                    for i in range(len(arg_types)):
-                        if not arg_types[i] == func.param_types[i]:
-                            matching_args = False
-                            break
-                    
-                    if matching_args:
-                        elements.append(func)
+            arg_types = [param.type for param in token.params if param.is_variable()]
+
+            elements = self.scope.callable_funcs(token.type, arg_types)
 
         # Static value dynamic elements.
         # TODO: Needs to be some logic/intelligence to this to 
-        elif token == "<int>":
-            return [str(random.randint(0, 5))]
-        
-        elif token == "<float>":
-            return [str(round(random.uniform(0, 5), 2))]
-        
-        elif token == "<bool>":
-            return [np.random.choice(["True", "False"])]
-
-        elif token == "<int[]>":
-            return ["[]"]
+        elif token.kind == "value":
+            if token.type == "int":
+                return [str(self.rng.integers(0, 6))]
+            
+            elif token.type == "float":
+                return [str(round(float(self.rng.uniform(0, 5)), 2))]
+            
+            elif token.type == "bool":
+                return [("True", "False")[self.rng.integers(2)]]
 
-        elif token == ["<float[]>"]:
-            return ["[]"]
+            elif token.type in ["int[]", "float[]"]:
+                return ["[]"]
 
         return elements
 
@@ -445,6 +456,17 @@ class Code():
                 file.write(str(instruction) + "\n")
 
 
+    def to_columns(self):
+        """
+        Return the written instructions as ProgramColumns with a single program.
+        Use a ProgramColumnsBuilder directly to collect many programs.
+        """
+        builder = ProgramColumnsBuilder()
+        builder.add_code(self)
+
+        return builder.build()
+
+
     def load_from_file(self, path):
         """
         Load pre-compiled code back into instruction objects.
@@ -453,26 +475,70 @@ class Code():
         with open(path, "r") as file:
             lines = file.read().splitlines()
 
+        self.load_lines(lines)
+
+
+    def load_lines(self, lines):
+        """
+        Load pre-compiled lines back into instruction objects,
+        ex: lines from a .pytmpl file or a ProgramArchive.
+        """
         for line in lines:
             instruction = Instruction()
             self.scope = instruction.load(line, self.scope)
             self.written_instructions.append(instruction)
 
+            for listener in self.listeners:
+                listener(instruction)
+
+
+    def fork(self, rng=None):
+        """
+        Return a new Code object continuing from the current state of self.
+        The scope is an O(1) snapshot, and the written instructions are shared,
+        as instructions are never changed once written.
+        Unless given an rng, the fork draws from an independent stream spawned from self.rng.
+        OBS: Cannot be used after calling finalize().
+        """
+        if self.available_instructions == None:
+            raise Exception("Trying to fork finalized Code.")
+
+        if rng == None:
+            rng = self.rng.spawn(1)[0]
+
+        fork = Code(self.available_instructions, self.index, self.tracer, rng, self.profiler)
+        fork.written_instructions = self.written_instructions.copy()
+        fork.scope = self.scope.snapshot()
+
+        return fork
+
 
     def clone(self):
         """
         Return a new Code object with identical member values as self.
+        Same as fork(), but with a copy of self.rng in its current state, so the clone
+        draws what self would draw next, without either one advancing the other.
         OBS: Cannot be used after calling finalize().
         """
         if self.available_instructions == None:
             raise Exception("Trying to clone finalized Code.")
-        
-        clone = Code(self.available_instructions)
-        
-        instruction_clones = []
-        for instruction in self.written_instructions:
-            instruction_clones.append(instruction.clone())
 
-        clone.written_instructions = instruction_clones
+        return self.fork(copy.deepcopy(self.rng))
+
+
+    def checkpoint(self):
+        """
+        Return a checkpoint of the current state, which can be restored with rollback().
+        """
+        return (len(self.written_instructions), self.scope.snapshot())
+
+
+    def rollback(self, checkpoint):
+        """
+        Restore a state returned by checkpoint(), removing all instructions written since.
+        The same checkpoint can be restored any number of times.
+        """
+        nr_written, scope = checkpoint
 
-        clone.scope = self.scope.clone()
\ No newline at end of file
+        del self.written_instructions[nr_written:]
+        self.scope = scope.snapshot()
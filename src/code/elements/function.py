@@ -1,13 +1,22 @@
 class Function():
     """docstring for Function."""
+
+    __slots__ = ("indent", "param_types", "param_arg_vars", "number", "return_type", "has_been_defined")
+
     def __init__(self, indent, param_types, param_arg_vars, number, return_type):
         self.indent = indent
-        self.param_types = param_types         # Ex: [int, int] for func(pvar<int>,pvar<int>)
-        self.param_arg_vars = param_arg_vars   # The actual Variable objects representing the arguments.
+        self.param_types = tuple(param_types)        # Ex: (int, int) for func(pvar<int>,pvar<int>)
+        self.param_arg_vars = tuple(param_arg_vars)  # The actual Variable objects representing the arguments.
         self.number = number
         self.return_type = return_type
         self.has_been_defined = False
-        self.has_returned = False
+
+
+    def signature(self):
+        """
+        Return the signature of the function, ex: ("int", ("int", "bool")).
+        """
+        return (self.return_type, self.param_types)
 
 
     def call(self, args=[]):
@@ -1,29 +1,43 @@
 from src.code.elements.function import Function
 from src.code.elements.variable import Variable
 from src.code.elements.scope import Scope
+from src.code.elements.template import Template
+from src.code.elements.token import lex
 
-import re
+import sys
 
 class Instruction():
     """Represents one line of Code"""
 
+    __slots__ = ("parsed_template", "elements", "indent", "pre_compiled_elements")
+
     def __init__(self, template=None):
-        self.template = []                   # List of elemnts in the instruction.
-        self.elements = []                   # Uncompiled elements. Mix of static strings & element objects.
+        self.parsed_template = None          # Shared Template object, parsed once when loaded.
+        self.elements = ()                   # Uncompiled elements, shared with the template until filled out.
         self.indent = None                   # Indentation of the line (amount of tabs)
-        self.pre_compiled_elements = []      # All elements after pre-compilation.
+        self.pre_compiled_elements = []      # All elements after pre-compilation. Interned tuple once completed.
 
         if template != None:
-            self.template = template.split(" ")
-            self.elements = self.template.copy()
+            # Accept both template strings and already parsed templates.
+            if not isinstance(template, Template):
+                template = Template(template)
+
+            self.parsed_template = template
+            self.elements = template.elements
+
+
+    @property
+    def template(self):
+        """Elements of the template of the instruction."""
+        if self.parsed_template == None:
+            return ()
+
+        return self.parsed_template.elements
 
 
     def is_statement(self):
         """Is this instruction a statement? i.e. does it increase indentation?"""
-        if self.template[0] in ["def", "for", "while", "if"]:
-            return True
-        else:
-            return False
+        return self.parsed_template.is_statement
 
 
     def get_required_elements(self):
@@ -40,32 +54,18 @@ class Instruction():
         """
         Is the function required to be inside of a function?
         """
-        for element in self.template:
-            if element == "return":
-                return True
-
-        return False
+        return self.parsed_template.must_be_in_function
 
 
     def get_dynamic_element_tokens(self, only_required=False):
         """
         Return ALL element tokens that are required to be filled out in order to complete the instruction.
-        This function also internally marks where those elements appear, which is used when
-        completing the instruction.
-        """
-        dynamic_elements = []
-        for element in self.template:
-            for sub_element in [elem[2:-2] for elem in re.findall("{{.*?}}", element)]:
-                # Dynamic element Values
-                if not only_required:
-                    if sub_element in ["<int>", "<bool>", "<float>", "<int[]>", "<float[]>"]:
-                        dynamic_elements.append(sub_element)
-                
-                # Variables and functions
-                if sub_element.startswith("var") or sub_element.startswith("func"):
-                    dynamic_elements.append(sub_element)
+        The tokens are parsed once by the Template, along with the slots where they appear.
+        """
+        if only_required:
+            return self.parsed_template.required_tokens
 
-        return dynamic_elements
+        return self.parsed_template.dynamic_tokens
 
 
     def precompile(self, args, scope):
@@ -75,19 +75,27 @@ class Instruction():
         Returns the updated scope.
         """
 
-        # TODO: Something similar to this but without using element indexes? (count nr of {{}}?)
+        template = self.parsed_template
+
         # Make sure that all dynamic elements are being filled.
-        # if len(args) != len(self.dynamic_element_indexes):
-        #     raise Exception("Incorrect number of dynamic elements when completing instruction.")
+        if len(args) != len(template.slots):
+            raise Exception("Incorrect number of dynamic elements when completing instruction.")
 
         # Make note if a function has called return.
-        if self.elements[0] == "return":
-            scope.in_function.has_returned = True
+        if template.is_return:
+            scope.has_returned = True
 
         # Replace dynamic elements with elements given by code_writer.
+        # The slots are in order, so each element is rebuilt from its parts once.
+        elements = list(template.elements)
         replacements_made = 0
-        for idx, element in enumerate(self.elements):
-            for dynamic_part in [elem for elem in re.findall("{{.*?}}", element)]:
+        for idx, parts in enumerate(template.element_parts):
+            if len(parts) == 1:
+                continue
+
+            filled_parts = list(parts)
+            for part_idx in range(1, len(parts), 2):
+                dynamic_part = parts[part_idx]
                 replacement = ""
                 
                 if dynamic_part.startswith("{{func"):
@@ -98,19 +106,23 @@ class Instruction():
                 else:
                     replacement = "{{"+str(args[replacements_made])+"}}"
 
-                self.elements[idx] = self.elements[idx].replace(dynamic_part, replacement, 1)
+                filled_parts[part_idx] = replacement
                 replacements_made += 1
-                print("Replacing", dynamic_part, "with", replacement, "in element", element)
-                print("Elements are now:", self.elements)
+
+            elements[idx] = "".join(filled_parts)
+
+        self.elements = tuple(sys.intern(element) for element in elements)
 
         # Create variable/func objects, update scope etc.
         # And finally, pre-compile elements into tokens.
         for element in self.elements:
             scope = self.parse_element(element, scope)
 
+        self.lock()
+
         # LASTLY!! Increase indent if this instruction is a statement.
         if self.is_statement():
-            scope.indent += 1
+            scope.increase_indentation()
 
         return scope
 
@@ -124,23 +136,33 @@ class Instruction():
         self.indent = string.count("\t")
         elements = string.replace("\t", "").replace("\n", "").split(" ")
 
-        self.template = self.recreate_tempalte(elements)
+        self.parsed_template = Template(" ".join(self.recreate_tempalte(elements)))
 
         # Make note if a function has called return.
         if elements[0] == "return":
-            scope.in_function.has_returned = True
+            scope.has_returned = True
 
         # Create variable/func objects, update scope etc.
         for element in elements:
             scope = self.parse_element(element, scope)
 
+        self.lock()
+
         # LASTLY!! Increase indent if this instruction is a statement.
         if self.is_statement():
-            scope.indent += 1
+            scope.increase_indentation()
 
         return scope  
 
 
+    def lock(self):
+        """
+        Lock in the completed instruction. The pre-compiled elements become a tuple
+        of interned strings, so identical tokens across all instructions share one object.
+        """
+        self.pre_compiled_elements = tuple(sys.intern(element) for element in self.pre_compiled_elements)
+
+
     def parse_element(self, element, scope):
         """
         Create variable/func objects, update scope etc.
@@ -164,48 +186,47 @@ class Instruction():
         # The instruction is defining a new function.
         # Create a new function object and argument variables if present.
         elif element.startswith("nfunc"):
-            return_type = re.findall(r"nfunc<(.*?)>", element)[0]
-            param_types = re.findall(r"pvar<(.*?)>", element)
+            token = lex(element)
+            return_type = token.type
+            param_types = [param.type for param in token.params if param.kind == "pvar"]
 
             # Create the argument variables representing the parameters, if present.
             param_arg_vars = []
             for param_type in param_types:
-                # TODO: Move handling of creation of vars/funcs to Scope class?
-                var_num = scope.vars[param_type]['num_created']
-                scope.vars[param_type]['num_created'] += 1
+                var_num = scope.new_var_number(param_type)
                 
                 var = Variable(param_type, scope.indent + 1, var_num, True)
                 var.has_been_defined = True
                 param_arg_vars.append(var)
-                scope.vars[param_type]['available'].append(var)
+                scope.add_var(var)
 
             # Create the function object.
-            func_num = scope.funcs['num_created']
-            scope.funcs['num_created'] += 1
+            func_num = scope.new_func_number()
             
             func = Function(scope.indent, param_types, param_arg_vars, func_num, return_type)
-            scope.funcs['available'].append(func)
+            scope.add_func(func)
 
             # Entering function body, mark what function it is so we know
             # when we are exiting it.
             scope.in_function = func
+            scope.has_returned = False
 
             self.pre_compiled_elements.append(str(func))
 
         # Creation of a variable.
         elif element.startswith("nvar") or element.startswith("pvar"):
-            var_type = re.findall(r"<(.*?)>", element)[0]
-            var_num = scope.vars[var_type]['num_created']
-            scope.vars[var_type]['num_created'] += 1
+            token = lex(element)
+            var_type = token.type
+            var_num = scope.new_var_number(var_type)
             
             indent = scope.indent
             is_argument = False
-            if element.startswith("pvar"):
+            if token.kind == "pvar":
                 is_argument = True
                 indent += 1
 
             var = Variable(var_type, indent, var_num, is_argument)
-            scope.vars[var_type]['available'].append(var)
+            scope.add_var(var)
 
             self.pre_compiled_elements.append(str(var))
 
@@ -232,7 +253,17 @@ class Instruction():
     def recreate_template_element(self, element):
         """
         Recreate an instruction element into the original template element.
+        Dynamic parts of an element are recreated one by one,
+        ex: "range({{3}},{{var<int>1}})" => "range({{<int>}},{{var<int>}})".
         """
+        if "{{" in element:
+            parts = element.split("{{")
+            for i in range(1, len(parts)):
+                dynamic_part, rest = parts[i].split("}}", 1)
+                parts[i] = self.recreate_template_element(dynamic_part) + "}}" + rest
+
+            return "{{".join(parts)
+
         if self.is_int(element):
             return "<int>"
 
@@ -245,14 +276,11 @@ class Instruction():
         elif self.is_int_list(element):
             return "<int[]>"
 
-        elif self.is_int_list(element):
+        elif self.is_float_list(element):
             return "<float[]>"
         
-        else:
-            # Remove variable/function numberings if present
-            element = re.sub(r"(<.*?>)[\d]+?", r"\1", element)
-
-        return element
+        # Remove variable/function numberings if present
+        return lex(element).template_text()
 
 
     def is_int(self, string):
@@ -318,9 +346,10 @@ class Instruction():
         """
         Return a new Instruction object with identical member values as self.
         """
-        clone = Instruction(" ".join(self.template))
+        clone = Instruction(self.parsed_template)
         clone.indent = self.indent
-        clone.pre_compiled_elements = self.pre_compiled_elements.copy()
+        clone.elements = self.elements
+        clone.pre_compiled_elements = self.pre_compiled_elements
 
         return clone
 
@@ -1,70 +1,208 @@
-import copy
+from src.instrumentation.profiler import REDUCE_INDENTATION
+
+import time
+
+VAR_TYPES = ["int", "float", "bool", "int[]", "float[]"]
+
+class Frame():
+    """
+    Variables and functions available on one level of indentation.
+
+    Frames are immutable and linked to the frame of the enclosing level, so any
+    number of Scope snapshots can share them. Adding an element creates a new
+    frame (and new frames for any levels above it), everything else is shared.
+    """
+    def __init__(self, parent, level, own_vars, own_funcs):
+        self.parent = parent        # Frame of the enclosing level, None for the outermost level.
+        self.level = level          # Level of indentation.
+        self.own_vars = own_vars    # Variables declared on this level, ex: {"int": (var,)}
+        self.own_funcs = own_funcs  # Functions declared on this level.
+
+        # Everything available on this level, including all enclosing levels.
+        # Types without own variables share the tuples of the parent.
+        if parent == None:
+            self.vars = {type: own_vars.get(type, ()) for type in VAR_TYPES}
+            self.funcs = own_funcs
+            self.func_index = {}
+        else:
+            self.vars = parent.vars
+            if len(own_vars) > 0:
+                self.vars = dict(parent.vars)
+                for type, vars in own_vars.items():
+                    self.vars[type] = parent.vars[type] + vars
+
+            self.funcs = parent.funcs
+            self.func_index = parent.func_index
+            if len(own_funcs) > 0:
+                self.funcs = parent.funcs + own_funcs
+                self.func_index = dict(parent.func_index)
+
+        # Functions by signature: (return type, parameter types) => tuple of functions.
+        for func in own_funcs:
+            signature = func.signature()
+            self.func_index[signature] = self.func_index.get(signature, ()) + (func,)
+
+
+    def with_var(self, var):
+        """
+        Return a new frame where var has been declared on the level var.indent.
+        """
+        if var.indent == self.level:
+            own_vars = dict(self.own_vars)
+            own_vars[var.type] = own_vars.get(var.type, ()) + (var,)
+            return Frame(self.parent, self.level, own_vars, self.own_funcs)
+
+        return Frame(self.parent.with_var(var), self.level, self.own_vars, self.own_funcs)
+
+
+    def with_func(self, func):
+        """
+        Return a new frame where func has been declared on the level func.indent.
+        """
+        if func.indent == self.level:
+            return Frame(self.parent, self.level, self.own_vars, self.own_funcs + (func,))
+
+        return Frame(self.parent.with_func(func), self.level, self.own_vars, self.own_funcs)
+
 
 class Scope():
+    """
+    Currently scoped dynamic elements & other scope related stuff.
+
+    All declared elements live in immutable frames, so snapshot() is O(1)
+    and snapshots share every frame that has not been changed since.
+    """
     def __init__(self):
         self.in_function = None # Are we currently inside of a function body? What function object?
+        self.has_returned = False # Has the current function returned?
         self.nr_instructions_in_func = 0 # How many lines have been written in the current function?
         self.indent = 0
-        self.vars = {}
-        self.vars = {
-            "int": {
-                "num_created": 0,
-                "available": []
-            },
-            "float": {
-                "num_created": 0,
-                "available": []
-            },
-            "bool": {
-                "num_created": 0,
-                "available": []
-            },
-            "int[]": {
-                "num_created": 0,
-                "available": []
-            },
-            "float[]": {
-                "num_created": 0,
-                "available": []
-            },
-        }
-        self.funcs = {
-            "num_created": 0,
-            "available": []
-        }
+        self.frame = Frame(None, 0, {}, ()) # Frame of the innermost level.
+        self.num_created_vars = {type: 0 for type in VAR_TYPES}
+        self.num_created_funcs = 0
+        self.profiler = None # Per-phase timing & counters, None when disabled
+
+
+    def vars_of_type(self, type):
+        """
+        Return all variables of a type that are in scope.
+        """
+        return self.frame.vars[type]
+
+
+    def has_vars_of_type(self, type):
+        """
+        Is any variable of a type in scope?
+        """
+        return len(self.frame.vars[type]) > 0
+
+
+    def available_funcs(self):
+        """
+        Return all functions that are in scope.
+        """
+        return self.frame.funcs
+
+
+    def callable_funcs(self, return_type, param_types):
+        """
+        Return all functions in scope with a signature, ex: ("int", ("int", "bool")).
+        The function currently being defined is excluded, to not allow recursion.
+        """
+        funcs = self.frame.func_index.get((return_type, tuple(param_types)), ())
+
+        if self.in_function in funcs:
+            funcs = tuple(func for func in funcs if func != self.in_function)
+
+        return funcs
+
+
+    def new_var_number(self, type):
+        """
+        Return the number of a new variable of a type.
+        """
+        number = self.num_created_vars[type]
+        self.num_created_vars[type] += 1
+
+        return number
+
+
+    def new_func_number(self):
+        """
+        Return the number of a new function.
+        """
+        number = self.num_created_funcs
+        self.num_created_funcs += 1
+
+        return number
+
+
+    def add_var(self, var):
+        """
+        Add a variable to the frame of its indentation.
+
+        Function/loop parameters are declared on the level of the body, before the
+        indentation is increased, so the frame of a level may be created in advance.
+        """
+        if var.indent > self.frame.level:
+            self.frame = Frame(self.frame, var.indent, {}, ())
+
+        self.frame = self.frame.with_var(var)
+
+
+    def add_func(self, func):
+        """
+        Add a function to the frame of its indentation.
+        """
+        if func.indent > self.frame.level:
+            self.frame = Frame(self.frame, func.indent, {}, ())
+
+        self.frame = self.frame.with_func(func)
+
+
+    def increase_indentation(self):
+        """
+        Increase indentation level, entering a new frame unless it was created in advance.
+        """
+        self.indent += 1
+
+        if self.frame.level < self.indent:
+            self.frame = Frame(self.frame, self.indent, {}, ())
+
 
     def reduce_indentation(self):
         """
-        Reduce indentation level and remove vars/funcs that go out of scope.
+        Reduce indentation level and remove vars/funcs that go out of scope,
+        by leaving the frames above the new level.
         """
         if self.indent == 0:
             raise Exception("Code: Trying to reduce indentation below 0")
-        
-        self.indent -= 1
-        
-        for type, obj in self.vars.items():
-            vars_still_in_scope = []
-            for var in obj['available']:
-                if var.indent <= self.indent:
-                    vars_still_in_scope.append(var)
 
-            self.vars[type]['available'] = vars_still_in_scope
+        if self.profiler != None:
+            start = time.perf_counter()
+
+        self.indent -= 1
 
-        funcs_still_in_scope = []
-        for func in self.funcs['available']:
-            if func.indent <= self.indent:
-                funcs_still_in_scope.append(func)
+        while self.frame.level > self.indent:
+            self.frame = self.frame.parent
 
-        self.funcs['available'] = funcs_still_in_scope
+        if self.profiler != None:
+            self.profiler.add(REDUCE_INDENTATION, time.perf_counter() - start)
 
 
-    def clone(self):
+    def snapshot(self):
         """
-        Return a new Sope object with identical member values as self.
+        Return a new Scope object with identical member values as self, in O(1).
+        Frames and the elements in them are shared, not copied.
         """
-        clone = Scope()
-        clone.in_function = self.in_function
-        clone.nr_instructions_in_func = self.nr_instructions_in_func
-        clone.indent = self.indent
-        clone.vars = copy.deepcopy(self.vars)
-        clone.funcs = copy.deepcopy(self.funcs)
\ No newline at end of file
+        snapshot = Scope.__new__(Scope)
+        snapshot.in_function = self.in_function
+        snapshot.has_returned = self.has_returned
+        snapshot.nr_instructions_in_func = self.nr_instructions_in_func
+        snapshot.indent = self.indent
+        snapshot.frame = self.frame
+        snapshot.num_created_vars = dict(self.num_created_vars)
+        snapshot.num_created_funcs = self.num_created_funcs
+        snapshot.profiler = self.profiler
+
+        return snapshot
@@ -0,0 +1,56 @@
+import re
+
+class Template():
+    """
+    Parsed instruction template, ex: "if {{var<int>}} < {{<int>}}".
+
+    A template is parsed once when loaded and then shared by every
+    instruction created from it, so it must never be modified.
+    """
+
+    STATEMENTS = ["def", "for", "while", "if"]
+    VALUE_TOKENS = ["<int>", "<bool>", "<float>", "<int[]>", "<float[]>"]
+
+    def __init__(self, string):
+        self.string = string
+        self.elements = tuple(string.split(" "))
+
+        # Every element split into static and dynamic parts, where all odd indexes are dynamic.
+        # Ex: "range({{<int>}},{{<int>}})" => ("range(", "{{<int>}}", ",", "{{<int>}}", ")")
+        self.element_parts = tuple(tuple(re.split("({{.*?}})", element)) for element in self.elements)
+
+        # Position of every dynamic part as (element index, part index), in the order they are filled.
+        self.slots = tuple(
+            (element_idx, part_idx)
+            for element_idx, parts in enumerate(self.element_parts)
+            for part_idx in range(1, len(parts), 2)
+        )
+
+        # Tokens that need to be filled out to complete an instruction, ex: ("var<int>", "<int>").
+        # Required tokens only include elements that already need to be in place
+        # in the code, such as variables and functions, and not static values.
+        dynamic_tokens = []
+        required_tokens = []
+        for element_idx, part_idx in self.slots:
+            token = self.element_parts[element_idx][part_idx][2:-2]
+
+            if token in self.VALUE_TOKENS:
+                dynamic_tokens.append(token)
+
+            elif token.startswith("var") or token.startswith("func"):
+                dynamic_tokens.append(token)
+                required_tokens.append(token)
+
+        self.dynamic_tokens = tuple(dynamic_tokens)
+        self.required_tokens = tuple(required_tokens)
+
+        # Kind flags
+        self.is_statement = self.elements[0] in self.STATEMENTS    # Does it increase indentation?
+        self.is_nlb = self.elements[0] == "nlb"
+        self.is_return = self.elements[0] == "return"
+        self.is_def = self.elements[0] == "def"
+        self.must_be_in_function = "return" in self.elements
+
+
+    def __str__(self):
+        return self.string
@@ -0,0 +1,86 @@
+import re
+
+# A dynamic element token, ex: "var<int>", "nvar<int[]>3" or "nfunc<int>0(pvar<int>0,pvar<bool>0)".
+# Groups: kind, type, number, parameters (without the parentheses).
+TOKEN_PATTERN = re.compile(r"(nvar|pvar|var|nfunc|func)<([^<>]*)>(\d*)(?:\((.*)\))?$")
+
+# A dynamic value token, ex: "<int>".
+VALUE_PATTERN = re.compile(r"<([^<>]*)>$")
+
+VARIABLE_KINDS = ["nvar", "pvar", "var"]
+FUNCTION_KINDS = ["nfunc", "func"]
+
+# Interning cache of all lexed dynamic tokens, so every distinct token is only lexed once per process.
+# Static tokens are not cached, as any filled out element is one, ex: "range({{var<int>3}})".
+lexed_tokens = {}
+
+
+class Token():
+    """
+    Structured form of a token string.
+
+    Tokens are shared through the interning cache of lex(), so they must never be modified.
+    """
+    def __init__(self, text, kind, type=None, number=None, params=()):
+        self.text = text        # The token string
+        self.kind = kind        # "nvar", "pvar", "var", "nfunc", "func", "value" or "static"
+        self.type = type        # Variable type, return type or value type, ex: "int[]". None for static tokens.
+        self.number = number    # Number of the variable/function, None if not numbered (templates).
+        self.params = params    # Tuple of parameter/argument Tokens of a function.
+
+
+    def is_variable(self):
+        return self.kind in VARIABLE_KINDS
+
+
+    def is_function(self):
+        return self.kind in FUNCTION_KINDS
+
+
+    def template_text(self):
+        """
+        The token with all numberings removed, ex: "func<int>0(var<int>1)" => "func<int>(var<int>)".
+        """
+        if self.number == None and len(self.params) == 0:
+            return self.text
+
+        text = self.kind + "<" + self.type + ">"
+        if self.is_function():
+            text += "(" + ",".join(param.template_text() for param in self.params) + ")"
+
+        return text
+
+
+    def __repr__(self):
+        return "Token(" + self.text + ")"
+
+
+def lex(text):
+    """
+    Turn a token string into a Token in a single pass.
+    Strings that are not dynamic elements become static tokens, which are not cached.
+    """
+    token = lexed_tokens.get(text)
+    if token != None:
+        return token
+
+    match = TOKEN_PATTERN.match(text)
+    if match != None:
+        kind, type, number, params = match.groups()
+
+        param_tokens = ()
+        if params:
+            param_tokens = tuple(lex(param) for param in params.split(","))
+
+        token = Token(text, kind, type, int(number) if number else None, param_tokens)
+
+    else:
+        match = VALUE_PATTERN.match(text)
+        if match != None:
+            token = Token(text, "value", match.group(1))
+        else:
+            return Token(text, "static")
+
+    lexed_tokens[text] = token
+
+    return token
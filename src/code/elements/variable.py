@@ -1,5 +1,8 @@
 class Variable():
     """docstring for Variable."""
+
+    __slots__ = ("type", "indent", "number", "idx_of", "is_argument", "has_been_defined")
+
     def __init__(self, type, indent, number, is_argument=False):
         self.type = type
         self.indent = indent
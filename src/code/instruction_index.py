@@ -0,0 +1,84 @@
+from src.code.writability_masks import WritabilityMasks
+from src.code.writable_set_cache import WritableSetCache
+
+import numpy as np
+
+class InstructionGroup():
+    """
+    A group of loaded instructions that share everything the writability
+    checks look at: kind, statement flag, function requirement and required elements.
+    """
+    def __init__(self, kind, is_statement, must_be_in_function, requirements):
+        self.kind = kind                                 # "nlb", "return", "def" or None for any other instruction
+        self.is_statement = is_statement
+        self.must_be_in_function = must_be_in_function
+        self.requirements = requirements                 # Tuple of required element tokens, ex: ("var<int>",)
+        self.ids = []                                    # Template ids of the instructions, see InstructionIndex.templates
+
+
+class InstructionIndex():
+    """
+    Index of all loaded instructions, built once.
+
+    Instructions are grouped by their requirements and structural flags,
+    so that the checks in Code.find_writable_instructions() are done once
+    per group instead of once per instruction.
+
+    Every template also gets an id (its position in self.templates), which
+    is used to look up its features when scoring writable instructions.
+    """
+
+    def __init__(self, instructions):
+        self.groups = []
+        self.templates = []   # Shared Template objects, indexed by template id.
+
+        groups_by_key = {}
+        for instruction in instructions:
+            template = instruction.parsed_template
+
+            kind = None
+            if template.is_nlb:
+                kind = "nlb"
+            elif template.is_return:
+                kind = "return"
+            elif template.is_def:
+                kind = "def"
+
+            # The order of the requirements does not matter, but duplicates are only checked once.
+            requirements = tuple(dict.fromkeys(template.required_tokens))
+
+            key = (kind, template.is_statement, template.must_be_in_function, requirements)
+
+            group = groups_by_key.get(key)
+            if group == None:
+                group = InstructionGroup(kind, template.is_statement, template.must_be_in_function, requirements)
+                groups_by_key[key] = group
+                self.groups.append(group)
+
+            group.ids.append(len(self.templates))
+            self.templates.append(template)
+
+        for group in self.groups:
+            group.ids = np.array(group.ids, dtype=np.intp)
+
+        # Per template features used by Code.select_instruction().
+        self.is_nlb = np.array([template.is_nlb for template in self.templates], dtype=bool)
+        self.is_statement = np.array([template.is_statement for template in self.templates], dtype=bool)
+        self.is_return = np.array([template.is_return for template in self.templates], dtype=bool)
+
+        # Requirements of every template as bitmasks, to find all writable instructions at once.
+        self.masks = WritabilityMasks(self.groups)
+
+        # Writable sets of recurring states, shared by every Code object using this index.
+        self.writable_sets = WritableSetCache()
+
+        # Pipeline of writability checks, shared by every Code object using this index
+        # so it adapts to all of them. Set up by the first Code object, see Code.__init__().
+        self.checks = None
+
+
+    def features(self, ids):
+        """
+        Return the relevance features (is_nlb, is_statement, is_return) of templates, as arrays.
+        """
+        return (self.is_nlb[ids], self.is_statement[ids], self.is_return[ids])
@@ -0,0 +1,239 @@
+from array import array
+
+import json
+import numpy as np
+import os
+
+# Identifies a program archive, followed by the length of the JSON header.
+MAGIC = b"CEODIA-ARCHIVE\x00\x01"
+
+# Sections are aligned, so every array can be memory-mapped directly.
+ALIGNMENT = 8
+
+
+class ProgramArchiveWriter():
+    """
+    Write pre-compiled programs to a binary program archive.
+
+    Every distinct token (element of a pre-compiled line) gets an id in a shared
+    vocabulary. A program is then stored as one indent byte and a run of token ids
+    per line, with offsets marking where each line and each program begins.
+
+    Ex: "\\tint1 = 3" becomes the indent 1 & the token ids of ["int1", "=", "3"].
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.vocabulary = {}                    # Token string => token id
+        self.token_ids = array("I")             # Token ids of all lines, back to back.
+        self.indents = array("B")               # Indent of each line.
+        self.line_offsets = array("Q", [0])     # Position of the first token of each line in token_ids.
+        self.program_offsets = array("Q", [0])  # Position of the first line of each program in indents.
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Only write complete archives.
+        if exc_type == None:
+            self.close()
+
+
+    def add_program(self, lines):
+        """
+        Add a program, given as pre-compiled lines, ex: Code.save_to_file() lines.
+        """
+        for line in lines:
+            line = line.rstrip("\n")
+            indent = len(line) - len(line.lstrip("\t"))
+
+            if indent > 255:
+                raise Exception("ProgramArchive: Indentation " + str(indent) + " does not fit in a byte.")
+
+            self.indents.append(indent)
+            for token in line[indent:].split(" "):
+                token_id = self.vocabulary.get(token)
+                if token_id == None:
+                    token_id = len(self.vocabulary)
+                    self.vocabulary[token] = token_id
+
+                self.token_ids.append(token_id)
+
+            self.line_offsets.append(len(self.token_ids))
+
+        self.program_offsets.append(len(self.indents))
+
+
+    def add_code(self, code):
+        """
+        Add the written instructions of a Code object as a program.
+        """
+        self.add_program(str(instruction) for instruction in code.written_instructions)
+
+
+    def close(self):
+        """
+        Write the archive to file.
+        """
+        # Tokens never contain whitespace, so the vocabulary is stored as one string.
+        vocabulary = "\n".join(self.vocabulary).encode("utf-8")
+
+        sections = [
+            ("vocabulary", np.frombuffer(vocabulary, dtype=np.uint8)),
+            ("program_offsets", np.frombuffer(self.program_offsets, dtype=np.uint64)),
+            ("line_offsets", np.frombuffer(self.line_offsets, dtype=np.uint64)),
+            ("indents", np.frombuffer(self.indents, dtype=np.uint8)),
+            ("token_ids", np.frombuffer(self.token_ids, dtype=np.uint32)),
+        ]
+
+        # Most vocabularies are small enough for two byte token ids.
+        if len(self.vocabulary) <= 65536:
+            sections[-1] = ("token_ids", sections[-1][1].astype(np.uint16))
+
+        # Describe every section in the header, positioned relative to the end of the header.
+        header = {"sections": {}}
+        position = 0
+        for name, data in sections:
+            header["sections"][name] = {"dtype": data.dtype.str, "offset": position, "length": len(data)}
+            position = aligned(position + data.nbytes)
+
+        header_bytes = json.dumps(header).encode("utf-8")
+        data_start = aligned(len(MAGIC) + 8 + len(header_bytes))
+
+        # Write to a temporary file first, so an archive is never left half written.
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(MAGIC)
+            file.write(len(header_bytes).to_bytes(8, "little"))
+            file.write(header_bytes)
+
+            for name, data in sections:
+                file.seek(data_start + header["sections"][name]["offset"])
+                file.write(data.tobytes())
+
+            # Pad the file so the last section is complete.
+            file.truncate(data_start + position)
+
+        os.replace(temporary_path, self.path)
+
+
+class ProgramArchive():
+    """
+    Read-only, memory-mapped access to a program archive written by ProgramArchiveWriter.
+    Only the programs being read are loaded from disk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise Exception("ProgramArchive: " + path + " is not a program archive.")
+
+            header_length = int.from_bytes(file.read(8), "little")
+            header = json.loads(file.read(header_length).decode("utf-8"))
+
+        data_start = aligned(len(MAGIC) + 8 + header_length)
+
+        sections = {}
+        for name, section in header["sections"].items():
+            if section["length"] == 0:
+                sections[name] = np.empty(0, dtype=section["dtype"])
+            else:
+                sections[name] = np.memmap(path, dtype=section["dtype"], mode="r", offset=data_start + section["offset"], shape=(section["length"],))
+
+        self.program_offsets = sections["program_offsets"]
+        self.line_offsets = sections["line_offsets"]
+        self.indents = sections["indents"]
+        self.token_ids = sections["token_ids"]
+
+        # The vocabulary is small, so it is decoded once.
+        self.vocabulary = bytes(sections["vocabulary"]).decode("utf-8").split("\n")
+
+
+    def __len__(self):
+        return len(self.program_offsets) - 1
+
+
+    def __getitem__(self, number):
+        return self.program_lines(number)
+
+
+    def program_lines(self, number):
+        """
+        Return the pre-compiled lines of a program, same as in a .pytmpl file.
+        """
+        if number < 0:
+            number += len(self)
+
+        if number < 0 or number >= len(self):
+            raise IndexError("ProgramArchive: No program " + str(number) + ".")
+
+        first_line = int(self.program_offsets[number])
+        last_line = int(self.program_offsets[number + 1])
+
+        indents = self.indents[first_line:last_line].tolist()
+        line_offsets = self.line_offsets[first_line:last_line + 1].tolist()
+        token_ids = self.token_ids[line_offsets[0]:line_offsets[-1]].tolist()
+
+        first_token = line_offsets[0]
+        lines = []
+        for i, indent in enumerate(indents):
+            tokens = token_ids[line_offsets[i] - first_token:line_offsets[i + 1] - first_token]
+            lines.append("\t" * indent + " ".join(self.vocabulary[token_id] for token_id in tokens))
+
+        return lines
+
+
+    def load_into(self, code, number):
+        """
+        Load a program into a Code object, same as Code.load_from_file().
+        """
+        code.load_lines(self.program_lines(number))
+
+        return code
+
+
+def aligned(position):
+    """
+    Round a position up to the next section alignment.
+    """
+    return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def pytmpl_to_archive(pytmpl_paths, archive_path):
+    """
+    Convert .pytmpl files into one program archive, in the given order.
+    Returns the number of programs written.
+    """
+    count = 0
+    with ProgramArchiveWriter(archive_path) as writer:
+        for path in pytmpl_paths:
+            with open(path, "r") as file:
+                writer.add_program(file.read().splitlines())
+            count += 1
+
+    return count
+
+
+def archive_to_pytmpl(archive_path, out_dir, prefix="program"):
+    """
+    Convert a program archive into .pytmpl files, out_dir/<prefix>N.pytmpl.
+    Returns the paths of the written files.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    archive = ProgramArchive(archive_path)
+
+    paths = []
+    for number in range(len(archive)):
+        path = os.path.join(out_dir, prefix + str(number) + ".pytmpl")
+        with open(path, "w") as file:
+            for line in archive.program_lines(number):
+                file.write(line + "\n")
+
+        paths.append(path)
+
+    return paths
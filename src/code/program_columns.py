@@ -0,0 +1,144 @@
+from array import array
+
+import numpy as np
+
+
+class ProgramColumns():
+    """
+    Columnar representation of any number of written programs.
+
+    Instead of one Instruction object per line, every line is a row in flat
+    NumPy arrays, so statistics over a whole batch are vectorized array operations.
+
+    Templates and tokens (pre-compiled elements) are stored once in vocabularies
+    and referred to by id. Ex: the line "\\tint1 = 3" of the template
+    "{{var<int>}} = {{<int>}}" is the indent 1, the id of the template and
+    the token ids of ["int1", "=", "3"].
+    """
+
+    def __init__(self, templates, vocabulary, indents, template_ids, token_ids, line_offsets, program_offsets):
+        self.templates = templates              # Template objects, indexed by template id.
+        self.vocabulary = vocabulary            # Token strings, indexed by token id.
+        self.indents = indents                  # uint8 indent per line.
+        self.template_ids = template_ids        # int32 template id per line.
+        self.token_ids = token_ids              # uint32 token ids of all lines, back to back.
+        self.line_offsets = line_offsets        # Position of the first token of each line in token_ids, plus the end.
+        self.program_offsets = program_offsets  # Position of the first line of each program, plus the end.
+
+        # Kind flags per template, so they can be looked up per line with template_ids.
+        self.is_nlb = np.array([template.is_nlb for template in templates], dtype=bool)
+        self.is_statement = np.array([template.is_statement for template in templates], dtype=bool)
+        self.is_return = np.array([template.is_return for template in templates], dtype=bool)
+
+
+    def __len__(self):
+        return len(self.program_offsets) - 1
+
+
+    def program_lengths(self):
+        """
+        Return the number of lines of every program.
+        """
+        return np.diff(self.program_offsets)
+
+
+    def line_programs(self):
+        """
+        Return the program number of every line.
+        """
+        return np.repeat(np.arange(len(self)), self.program_lengths())
+
+
+    def template_counts(self):
+        """
+        Return how many times every template has been written, over all programs.
+        """
+        return np.bincount(self.template_ids, minlength=len(self.templates))
+
+
+    def max_indents(self):
+        """
+        Return the deepest indentation of every program, 0 for empty programs.
+        """
+        max_indents = np.zeros(len(self), dtype=np.uint8)
+
+        lengths = self.program_lengths()
+        non_empty = lengths > 0
+        if np.any(non_empty):
+            max_indents[non_empty] = np.maximum.reduceat(self.indents, self.program_offsets[:-1][non_empty])
+
+        return max_indents
+
+
+    def program_lines(self, number):
+        """
+        Yield (template, indent, pre-compiled elements) for every line of a program.
+        """
+        first_line = int(self.program_offsets[number])
+        last_line = int(self.program_offsets[number + 1])
+
+        for line in range(first_line, last_line):
+            tokens = self.token_ids[self.line_offsets[line]:self.line_offsets[line + 1]]
+            elements = [self.vocabulary[token_id] for token_id in tokens.tolist()]
+
+            yield self.templates[self.template_ids[line]], int(self.indents[line]), elements
+
+
+class ProgramColumnsBuilder():
+    """
+    Collect written programs and build ProgramColumns out of them.
+    """
+
+    def __init__(self):
+        self.template_ids_by_string = {}        # Template string => template id
+        self.templates = []
+        self.vocabulary = {}                    # Token string => token id
+        self.indents = array("B")
+        self.template_ids = array("i")
+        self.token_ids = array("I")
+        self.line_offsets = array("q", [0])
+        self.program_offsets = array("q", [0])
+
+
+    def add_code(self, code):
+        """
+        Add the written instructions of a Code object as a program.
+        """
+        for instruction in code.written_instructions:
+            template = instruction.parsed_template
+
+            template_id = self.template_ids_by_string.get(template.string)
+            if template_id == None:
+                template_id = len(self.templates)
+                self.template_ids_by_string[template.string] = template_id
+                self.templates.append(template)
+
+            self.indents.append(instruction.indent)
+            self.template_ids.append(template_id)
+
+            for element in instruction.pre_compiled_elements:
+                token_id = self.vocabulary.get(element)
+                if token_id == None:
+                    token_id = len(self.vocabulary)
+                    self.vocabulary[element] = token_id
+
+                self.token_ids.append(token_id)
+
+            self.line_offsets.append(len(self.token_ids))
+
+        self.program_offsets.append(len(self.indents))
+
+
+    def build(self):
+        """
+        Return the collected programs as ProgramColumns.
+        """
+        return ProgramColumns(
+            list(self.templates),
+            list(self.vocabulary),
+            np.array(self.indents, dtype=np.uint8),
+            np.array(self.template_ids, dtype=np.int32),
+            np.array(self.token_ids, dtype=np.uint32),
+            np.array(self.line_offsets, dtype=np.int64),
+            np.array(self.program_offsets, dtype=np.int64),
+        )
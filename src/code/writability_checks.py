@@ -0,0 +1,417 @@
+from src.code.writable_set_cache import WritableSetCache
+
+import numpy as np
+import time
+
+# Reorder the checks after this many steps, when reordering adaptively.
+REORDER_INTERVAL = 256
+
+# Measure the checks once every this many steps, starting with the first.
+# All other steps run the checks without any bookkeeping.
+TIMING_INTERVAL = 16
+
+
+# Predicates on the properties of a group, returned by checks that reject them in the current state.
+def is_nlb(group):
+    return group.kind == "nlb"
+
+def is_not_nlb(group):
+    return group.kind != "nlb"
+
+def is_return(group):
+    return group.kind == "return"
+
+def is_def(group):
+    return group.kind == "def"
+
+def is_statement(group):
+    return group.is_statement
+
+def must_be_in_function(group):
+    return group.must_be_in_function
+
+
+def reject(groups, rejects):
+    """
+    Return the groups not rejected by a function, in order.
+    """
+    return tuple([group for group in groups if not rejects(group)])
+
+
+class WritabilityCheck():
+    """
+    A named check that an instruction group has to pass to be writable.
+
+    Most of a check only depends on the state of the code, not on the group. So once
+    per step, prepare() evaluates that part and returns a plain function rejecting
+    groups, or None if the check rejects no group in the current state. Checks only
+    reject groups and have no side effects, so they can be evaluated in any order.
+
+    Checks that are not static depend on the state for every group, and instead
+    return a function filtering a list of groups, so the loop over them is inlined.
+
+    On measured steps, every check keeps track of how many groups it is evaluated on,
+    how many it rejects and how much time it takes.
+    """
+
+    name = None
+    description = None
+    static = True   # Does prepare() return functions of only the properties of a group? See WritabilityChecks.
+
+    def __init__(self):
+        self.evaluations = 0    # Evaluations during measured steps.
+        self.rejections = 0     # Rejections during measured steps.
+        self.seconds = 0.0      # Time spent during measured steps.
+
+
+    def prepare(self, code):
+        """
+        Return a function of a group, which returns True if the group can not be written
+        in the current state of code. Returns None if no group is rejected.
+        Checks that are not static return a function returning the writable groups of a list.
+        """
+        raise NotImplementedError()
+
+
+    def cost(self):
+        """
+        Expected time spent on this check per rejection. The lower, the earlier it should run.
+        Checks that have never been evaluated go first, so they get measured.
+        """
+        if self.evaluations == 0:
+            return 0.0
+
+        seconds_per_evaluation = self.seconds / self.evaluations
+        rejection_rate = self.rejections / self.evaluations
+
+        if rejection_rate == 0:
+            return float("inf")
+
+        return seconds_per_evaluation / rejection_rate
+
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "description": self.description,
+            "evaluations": self.evaluations,
+            "rejections": self.rejections,
+            "rejection_rate": self.rejections / self.evaluations if self.evaluations > 0 else 0.0,
+            "seconds_per_evaluation": self.seconds / self.evaluations if self.evaluations > 0 else 0.0,
+        }
+
+
+class UnreachableAfterReturn(WritabilityCheck):
+    name = "unreachable_after_return"
+    description = "After a return on the first level of a function body, only nlb can follow, otherwise the code would be unreachable."
+
+    def prepare(self, code):
+        in_function = code.scope.in_function
+        if in_function != None and code.scope.indent == in_function.indent + 1:
+            if code.written_instructions[-1].parsed_template.is_return:
+                return is_not_nlb
+
+        return None
+
+
+class ReturnPlacement(WritabilityCheck):
+    name = "return_placement"
+    description = "Only return in a non-void function, on the first level of its body."
+
+    def prepare(self, code):
+        in_function = code.scope.in_function
+        if in_function == None:
+            return None
+
+        if in_function.return_type == "void" or code.scope.indent != in_function.indent + 1:
+            return is_return
+
+        return None
+
+
+class NlbPlacement(WritabilityCheck):
+    name = "nlb_placement"
+    description = "Do not reduce indentation below 0, just after a statement, or when exiting a non-void function before return."
+
+    def prepare(self, code):
+        scope = code.scope
+        if scope.indent == 0:
+            return is_nlb
+
+        if len(code.written_instructions) > 0:
+            if code.written_instructions[-1].is_statement():
+                return is_nlb
+
+        if scope.in_function != None:
+            if scope.indent == scope.in_function.indent + 1:
+                if not scope.has_returned:
+                    return is_nlb
+
+        return None
+
+
+class MaxIndent(WritabilityCheck):
+    name = "max_indent"
+    description = "Do not increase indentation past the max indentation."
+
+    def __init__(self, max_indent):
+        WritabilityCheck.__init__(self)
+        self.max_indent = max_indent
+
+    def prepare(self, code):
+        if code.scope.indent == self.max_indent:
+            return is_statement
+
+        return None
+
+
+class RequirementsPresent(WritabilityCheck):
+    name = "requirements_present"
+    description = "All required dynamic elements are present in the scope."
+    static = False
+
+    def prepare(self, code):
+        # Requirements already checked during this step, ex: {"var<int>": True}
+        present_requirements = {}
+        requirement_is_present = code.requirement_is_present
+
+        def writable(groups):
+            writable_groups = []
+            for group in groups:
+                for requirement in group.requirements:
+                    present = present_requirements.get(requirement)
+                    if present == None:
+                        present = requirement_is_present(requirement)
+                        present_requirements[requirement] = present
+
+                    if not present:
+                        break
+                else:
+                    writable_groups.append(group)
+
+            return tuple(writable_groups)
+
+        return writable
+
+
+class FunctionScope(WritabilityCheck):
+    name = "function_scope"
+    description = "Instructions requiring a function scope are only written inside of a function."
+
+    def prepare(self, code):
+        if code.scope.in_function == None:
+            return must_be_in_function
+
+        return None
+
+
+class DefAtTopLevel(WritabilityCheck):
+    name = "def_at_top_level"
+    description = "Do not write functions on indent above 0."
+
+    def prepare(self, code):
+        if code.scope.indent != 0:
+            return is_def
+
+        return None
+
+
+class WritabilityChecks():
+    """
+    Pipeline of writability checks, evaluated in order.
+
+    A group is writable if no check rejects it, so the order only affects speed.
+    When adaptive, the checks are reordered every REORDER_INTERVAL steps so the
+    cheapest checks that reject the most run first. The order can also be set
+    from the stats of an earlier run, see reorder_from().
+
+    Every step, each check in turn is prepared into a plain function, and applied
+    to the groups that passed the checks before it. Checks rejecting nothing in the
+    current state are skipped, and once no group is left the remaining checks are
+    not even prepared. Static checks return the same few functions of group
+    properties, so as long as only static checks have been applied, the groups
+    passing them are looked up instead of computed. A check that is not static
+    filters the groups left at its place in the order, and every check after it
+    is applied group by group.
+
+    Only every TIMING_INTERVAL steps are the checks measured, all other steps have
+    no bookkeeping at all. The writable set of each distinct combination of writable
+    groups is also kept, see writable_set(). A pipeline belongs to an InstructionIndex,
+    and is always given its groups.
+    """
+
+    def __init__(self, max_indent, adaptive=True):
+        self.adaptive = adaptive
+        self.steps = 0
+
+        # Same order as the checks were originally written in.
+        self.checks = [
+            UnreachableAfterReturn(),
+            ReturnPlacement(),
+            NlbPlacement(),
+            MaxIndent(max_indent),
+            RequirementsPresent(),
+            FunctionScope(),
+            DefAtTopLevel(),
+        ]
+
+        self.prepares = None    # (bound prepare(), static) of every check, in the current order.
+        self.passing = None     # Trie of the static functions applied first: [passing groups, {function: child}]
+        self.writable_sets = WritableSetCache()  # Writable groups => (template ids, features), as they recur.
+        self.set_order()
+
+
+    def writable_set(self, code, groups):
+        """
+        Return the template ids of the groups that pass every check, along with
+        their relevance features, as returned by Code.find_writable_set().
+        """
+        writable_groups = self.passing_groups(code, groups)
+
+        writable_set = self.writable_sets.get(writable_groups)
+        if writable_set == None:
+            if len(writable_groups) == 0:
+                writable_ids = np.empty(0, dtype=np.intp)
+            else:
+                writable_ids = np.concatenate([group.ids for group in writable_groups])
+
+            writable_set = (writable_ids, code.index.features(writable_ids))
+            self.writable_sets.put(writable_groups, writable_set)
+
+        return writable_set
+
+
+    def writable_groups(self, code, groups):
+        """
+        Return the groups that pass every check in the current state of code.
+        """
+        return list(self.passing_groups(code, groups))
+
+
+    def passing_groups(self, code, groups):
+        """
+        Same as writable_groups(), but returns a tuple which may be shared between steps.
+        """
+        self.steps += 1
+        if self.adaptive and self.steps % REORDER_INTERVAL == 0:
+            self.reorder()
+
+        if (self.steps - 1) % TIMING_INTERVAL == 0:
+            return self.measured_passing_groups(code, groups)
+
+        # Node of the static functions applied so far, None once a check that is not static has been applied.
+        node = self.root(groups)
+        writable_groups = node[0]
+
+        for prepare, static in self.prepares:
+            if len(writable_groups) == 0:
+                break
+
+            prepared = prepare(code)
+            if prepared == None:
+                continue
+
+            if not static:
+                writable_groups = prepared(writable_groups)
+                node = None
+            elif node != None:
+                child = node[1].get(prepared)
+                if child == None:
+                    child = [reject(writable_groups, prepared), {}]
+                    node[1][prepared] = child
+
+                node = child
+                writable_groups = child[0]
+            else:
+                writable_groups = reject(writable_groups, prepared)
+
+        return writable_groups
+
+
+    def measured_passing_groups(self, code, groups):
+        """
+        Same as passing_groups(), while measuring every check. Each check is timed as a
+        whole, from being prepared to being applied, and counts the groups it is applied
+        to as evaluations. Checks skipped as no group was left are not counted.
+        """
+        node = self.root(groups)
+        writable_groups = node[0]
+
+        for check in self.checks:
+            if len(writable_groups) == 0:
+                break
+
+            remaining = len(writable_groups)
+
+            start = time.perf_counter()
+            prepared = check.prepare(code)
+
+            if prepared == None:
+                pass
+            elif not check.static:
+                writable_groups = prepared(writable_groups)
+                node = None
+            elif node != None:
+                child = node[1].get(prepared)
+                if child == None:
+                    child = [reject(writable_groups, prepared), {}]
+                    node[1][prepared] = child
+
+                node = child
+                writable_groups = child[0]
+            else:
+                writable_groups = reject(writable_groups, prepared)
+
+            check.seconds += time.perf_counter() - start
+            check.evaluations += remaining
+            check.rejections += remaining - len(writable_groups)
+
+        return writable_groups
+
+
+    def root(self, groups):
+        """
+        Root of the trie of groups passing the static checks applied first, holding all groups.
+        """
+        if self.passing == None:
+            self.passing = [tuple(groups), {}]
+
+        return self.passing
+
+
+    def reorder(self):
+        """
+        Order the checks by their expected time per rejection, lowest first.
+        """
+        self.checks.sort(key=lambda check: check.cost())
+        self.set_order()
+
+
+    def reorder_from(self, stats):
+        """
+        Order the checks by the stats of an earlier run, as returned by report().
+        """
+        costs = {}
+        for check_stats in stats:
+            if check_stats["rejection_rate"] == 0:
+                costs[check_stats["name"]] = float("inf")
+            else:
+                costs[check_stats["name"]] = check_stats["seconds_per_evaluation"] / check_stats["rejection_rate"]
+
+        self.checks.sort(key=lambda check: costs.get(check.name, 0.0))
+        self.set_order()
+
+
+    def set_order(self):
+        """
+        Bind the checks in their current order, for the steps that are not measured.
+        """
+        self.prepares = [(check.prepare, check.static) for check in self.checks]
+        self.passing = None
+
+
+    def report(self):
+        """
+        Return the stats of every check, in the current order.
+        """
+        return [check.stats() for check in self.checks]
@@ -0,0 +1,189 @@
+from src.code.elements.scope import VAR_TYPES
+from src.code.elements.token import lex
+
+import numpy as np
+
+# Facts about the current state, each one bit of the state vector.
+IN_FUNCTION = "in_function"             # Inside of a function body.
+RETURN_ALLOWED = "return_allowed"       # On the first level of the body of a non-void function.
+NLB_ALLOWED = "nlb_allowed"             # Indentation can be reduced.
+BELOW_MAX_INDENT = "below_max_indent"   # Indentation can be increased.
+INDENT_ZERO = "indent_zero"             # Functions can be defined.
+BODY_OPEN = "body_open"                 # Not right after a return on the first level of a function body.
+
+FLAGS = [IN_FUNCTION, RETURN_ALLOWED, NLB_ALLOWED, BELOW_MAX_INDENT, INDENT_ZERO, BODY_OPEN]
+
+
+class WritabilityMasks():
+    """
+    The writability checks of Code, as bitmasks over all loaded instructions.
+
+    The state of the code is encoded as a vector of bits (flags, which variable
+    types are in scope and which function signatures can be called), and every
+    instruction gets a mask of the bits it requires. The writable instructions are
+    then found with a few vectorized operations: (masks & state) == masks.
+
+    Bits are split into 64 bit words, so any number of function signatures fit.
+    With a single word (the usual case), the masks are a flat array.
+    """
+
+    def __init__(self, groups):
+        self.bits = {}              # Name of a fact => bit, ex: {"var<int>": 6, ("int", ("int",)): 11}
+        self.var_types = []         # Variable types with a bit, in bit order.
+        self.signatures = []        # Function signatures with a bit, ex: ("int", ("int", "int")), in bit order.
+
+        for flag in FLAGS:
+            self.add_bit(flag)
+
+        for var_type in VAR_TYPES:
+            self.add_var_type(var_type)
+
+        # Required bits of every group.
+        group_masks = []
+        for group in groups:
+            mask = self.bit_mask(group)
+            group_masks.append(mask)
+
+        self.nr_words = (len(self.bits) + 63) // 64
+
+        # Instructions are ordered as when concatenating the ids of each group.
+        self.ids = np.concatenate([group.ids for group in groups]) if len(groups) > 0 else np.empty(0, dtype=np.intp)
+        self.masks = np.zeros((len(self.ids), self.nr_words), dtype=np.uint64)
+
+        position = 0
+        for group, mask in zip(groups, group_masks):
+            self.masks[position:position + len(group.ids)] = self.to_words(mask)
+            position += len(group.ids)
+
+        if self.nr_words == 1:
+            self.masks = self.masks[:, 0].copy()
+
+
+    def add_bit(self, name):
+        if name not in self.bits:
+            self.bits[name] = len(self.bits)
+
+        return self.bits[name]
+
+
+    def add_var_type(self, var_type):
+        key = "var<" + var_type + ">"
+        if key not in self.bits:
+            self.var_types.append(var_type)
+
+        return self.add_bit(key)
+
+
+    def add_signature(self, signature):
+        if signature not in self.bits:
+            self.signatures.append(signature)
+
+        return self.add_bit(signature)
+
+
+    def bit_mask(self, group):
+        """
+        Return the bits required by the instructions of a group, as an int.
+        """
+        mask = 0
+
+        if group.kind == "nlb":
+            mask |= 1 << self.bits[NLB_ALLOWED]
+        else:
+            mask |= 1 << self.bits[BODY_OPEN]
+
+        if group.kind == "return":
+            mask |= 1 << self.bits[RETURN_ALLOWED]
+
+        if group.kind == "def":
+            mask |= 1 << self.bits[INDENT_ZERO]
+
+        if group.is_statement:
+            mask |= 1 << self.bits[BELOW_MAX_INDENT]
+
+        if group.must_be_in_function:
+            mask |= 1 << self.bits[IN_FUNCTION]
+
+        for requirement in group.requirements:
+            token = lex(requirement)
+
+            if token.kind == "var":
+                mask |= 1 << self.add_var_type(token.type)
+
+            elif token.kind == "func":
+                # The arguments need to be available, and a function with the signature callable.
+                arg_types = tuple(param.type for param in token.params if param.is_variable())
+                for arg_type in arg_types:
+                    mask |= 1 << self.add_var_type(arg_type)
+
+                mask |= 1 << self.add_signature((token.type, arg_types))
+
+            else:
+                raise Exception("Trying to check for dynamic requirement of static element.")
+
+        return mask
+
+
+    def to_words(self, bits):
+        """
+        Split an int of bits into an array of 64 bit words.
+        """
+        return np.array([(bits >> (64 * word)) & 0xFFFFFFFFFFFFFFFF for word in range(self.nr_words)], dtype=np.uint64)
+
+
+    def state(self, scope, last_template, max_indent):
+        """
+        Return the state vector of a scope as an int, given the template of the
+        last written instruction (None if nothing is written) and the max indentation.
+        """
+        in_function = scope.in_function
+        indent = scope.indent
+
+        # On the first level of the body of the current function?
+        in_body = in_function != None and indent == in_function.indent + 1
+
+        state = 0
+
+        if in_function != None:
+            state |= 1 << self.bits[IN_FUNCTION]
+
+            if in_body and in_function.return_type != "void":
+                state |= 1 << self.bits[RETURN_ALLOWED]
+
+        if not (in_body and last_template.is_return):
+            state |= 1 << self.bits[BODY_OPEN]
+
+        # Do not reduce indentation below 0, just after a statement,
+        # or when exiting a function before returning.
+        if indent != 0:
+            if last_template == None or not last_template.is_statement:
+                if not (in_body and not scope.has_returned):
+                    state |= 1 << self.bits[NLB_ALLOWED]
+
+        if indent != max_indent:
+            state |= 1 << self.bits[BELOW_MAX_INDENT]
+
+        if indent == 0:
+            state |= 1 << self.bits[INDENT_ZERO]
+
+        for var_type in self.var_types:
+            if scope.has_vars_of_type(var_type):
+                state |= 1 << self.bits["var<" + var_type + ">"]
+
+        for signature in self.signatures:
+            if len(scope.callable_funcs(*signature)) > 0:
+                state |= 1 << self.bits[signature]
+
+        return state
+
+
+    def writable_ids(self, state):
+        """
+        Return the template ids of all instructions writable in a state, as an array.
+        """
+        if self.nr_words == 1:
+            return self.ids[(self.masks & np.uint64(state)) == self.masks]
+
+        state = self.to_words(state)
+
+        return self.ids[((self.masks & state) == self.masks).all(axis=1)]
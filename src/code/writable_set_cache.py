@@ -0,0 +1,67 @@
+from collections import OrderedDict
+
+
+class WritableSetCache():
+    """
+    Bounded LRU cache of writable sets, keyed on the state of the code.
+
+    The writable instructions only depend on the state encoded by WritabilityMasks
+    (indentation & function flags, the kind of the previous instruction, variable
+    types in scope and callable function signatures), and the same states recur
+    constantly. The cached value is the writable set along with its relevance features.
+
+    States are only meaningful together with the masks they were encoded by,
+    so a cache belongs to an InstructionIndex.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size        # Max number of cached states, 0 disables the cache.
+        self.entries = OrderedDict()    # State => (template ids, (is_nlb, is_statement, is_return))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def get(self, state):
+        """
+        Return the cached writable set of a state, or None.
+        """
+        entry = self.entries.get(state)
+        if entry == None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(state)
+        self.hits += 1
+
+        return entry
+
+
+    def put(self, state, entry):
+        """
+        Cache the writable set of a state, evicting the least recently used state if full.
+        """
+        if self.max_size == 0:
+            return
+
+        self.entries[state] = entry
+
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+
+    def info(self):
+        """
+        Return hits, misses, evictions, hit rate and current size of the cache.
+        """
+        lookups = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "size": len(self.entries),
+            "max_size": self.max_size,
+        }
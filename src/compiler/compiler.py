@@ -1,58 +1,61 @@
+from src.code.elements.token import lex
+from src.instrumentation.profiler import COMPILE
+
+from collections import OrderedDict
+
 import re
+import time
 
 class Compiler():
     """
     Compile from Statically Typed Psuedo-Python to Python3
+
+    Compiled elements are kept in a bounded LRU cache, shared by all programs
+    compiled by the same Compiler, since programs reuse the same few tokens over and over.
     """
 
-    def __init__(self):
-        pass
+    def __init__(self, cache_size=4096, profiler=None):
+        self.cache_size = cache_size              # Max number of cached elements, 0 disables the cache.
+        self.compiled_elements = OrderedDict()    # LRU cache of compiled elements, ex: {"var<int>0": "int0"}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.profiler = profiler                  # Per-phase timing & counters, None when disabled
 
     def compile(self, code):
         """
         Compile a pre-compiled Code Object to Python3 code. 
         Return a list of strings representing correctly indented Python3 code.
         """
-        compiled_lines = ["#!/usr/bin/env python3"]
+        stream = StreamingCompiler(self)
 
-        for i, instruction in enumerate(code.written_instructions):
-            
-            # Don't print multiple newlines for NLB.
-            if i > 1:
-                if instruction.template[0] == "nlb":
-                    if code.written_instructions[i-1].template[0] == "nlb":
-                        continue
-                    else:
-                        compiled_lines.append("")
-                        continue
-
-            # Vertical spacing.
-            if instruction.is_statement() or instruction.template[0] == "return":
-                if i > 1:
-                    prev_instr = code.written_instructions[i-1]
-                    if not prev_instr.is_statement() and prev_instr.template[0] != "nlb":
-                        compiled_lines.append("")
-            
-            compiled_elements = []
-            compiled_line = ""
+        for instruction in code.written_instructions:
+            stream.add_instruction(instruction)
 
-            # Set the indentation
-            for _ in range(instruction.indent):
-                compiled_line += "\t"
+        return stream.lines
 
-            # Compile each element of the instruction
-            for element in instruction.pre_compiled_elements:
-                compiled_elements.append(self.compile_element(element))
 
-            # Make the line a string
-            compiled_line += " ".join(compiled_elements)
-            
-            if instruction.is_statement():
-                compiled_line += ":"
-            
-            compiled_lines.append(compiled_line)
+    def compile_columns(self, columns, number):
+        """
+        Compile a single program of ProgramColumns to Python3 code.
+        Return a list of strings representing correctly indented Python3 code.
+        """
+        stream = StreamingCompiler(self)
+
+        for template, indent, elements in columns.program_lines(number):
+            stream.add_line(template, indent, elements)
+
+        return stream.lines
 
-        return compiled_lines
+
+    def stream(self, code):
+        """
+        Subscribe a StreamingCompiler to code, compiling each instruction as it is written.
+        Returns the StreamingCompiler, its lines are complete as soon as the code is.
+        """
+        stream = StreamingCompiler(self)
+        code.subscribe(stream.add_instruction)
+
+        return stream
 
 
     def compile_and_write(self, code, path):
@@ -60,16 +63,53 @@ class Compiler():
         Compile code and write to file. Returns compiled code as list of strings if desired.
         """
         compiled_lines = self.compile(code)
+        self.write(compiled_lines, path)
+
+        return compiled_lines
+
 
+    def write(self, compiled_lines, path):
+        """
+        Write compiled lines to file.
+        """
         with open(path, "w") as file:
             for line in compiled_lines:
                 file.write(line + "\n")
 
-        return compiled_lines
 
     def compile_element(self, element):
         """
-        Compile and instruction element.
+        Compile an instruction element, looking it up in the LRU cache first.
+        """
+        compiled_element = self.compiled_elements.get(element)
+        if compiled_element != None:
+            self.compiled_elements.move_to_end(element)
+            self.cache_hits += 1
+            return compiled_element
+
+        self.cache_misses += 1
+        compiled_element = self.compile_uncached_element(element)
+
+        if self.cache_size > 0:
+            self.compiled_elements[element] = compiled_element
+
+            # Evict the least recently used element.
+            if len(self.compiled_elements) > self.cache_size:
+                self.compiled_elements.popitem(last=False)
+
+        return compiled_element
+
+
+    def cache_info(self):
+        """
+        Return hits, misses and current size of the element cache.
+        """
+        return {"hits": self.cache_hits, "misses": self.cache_misses, "size": len(self.compiled_elements), "max_size": self.cache_size}
+
+
+    def compile_uncached_element(self, element):
+        """
+        Compile an instruction element.
         """
         if "{{" not in element:
             if element.startswith("nvar") or element.startswith("pvar") or element.startswith("var"):
@@ -105,16 +145,14 @@ class Compiler():
         Ex 1: nfunc<int>0(pvar<int>0,pvar<bool>0) => func0_int(arg_int0, arg_bool0)
         Ex 2: func<void>3() => func0_void()
         """
-        params = re.findall(r"[p]*var<.*?>\d+", element)
-        return_type = re.findall(r"func<(.*?)>", element)[0]
-        return_type = return_type.replace("[]", "_list")
-        number = re.findall(r">([\d]+?)\(", element)[0]
+        token = lex(element)
+        return_type = token.type.replace("[]", "_list")
 
         compiled_params = []
-        for param in params:
-            compiled_params.append(self.compile_var_name(param))
+        for param in token.params:
+            compiled_params.append(self.compile_var_name(param.text))
 
-        name = "func_" + return_type + number
+        name = "func_" + return_type + str(token.number)
 
         param_list = "(" + ", ".join(compiled_params) + ")"
 
@@ -127,9 +165,77 @@ class Compiler():
         Ex 1: nvar<int>1 => int1
         Ex 2: pvar<bool>3 => arg_bool3
         """
-        var_type = re.findall(r"<(.*?)>", element)[0].replace("[]", "_list")
-        number = re.findall(r">([\d]+)", element)[0]
+        token = lex(element)
+
+        name = token.type.replace("[]", "_list") + str(token.number)
+
+        return name
+
+class StreamingCompiler():
+    """
+    Compile instructions one by one, as they are written.
+
+    Only the previous instruction is needed for collapsing NLBs & vertical spacing,
+    so the compiled lines are ready as soon as the last instruction has been written.
+    """
+
+    def __init__(self, compiler):
+        self.compiler = compiler            # Compiler used for the elements, sharing its cache.
+        self.lines = ["#!/usr/bin/env python3"]
+        self.nr_instructions = 0            # Number of instructions compiled so far.
+        self.prev_is_nlb = False            # Was the previous instruction a NLB?
+        self.prev_is_statement = False      # Was the previous instruction a statement?
+
+
+    def add_instruction(self, instruction):
+        """
+        Compile a pre-compiled instruction and add it to the compiled lines.
+        """
+        self.add_line(instruction.parsed_template, instruction.indent, instruction.pre_compiled_elements)
+
+
+    def add_line(self, template, indent, pre_compiled_elements):
+        """
+        Compile a pre-compiled line, given as its template, indent & pre-compiled elements.
+        """
+        profiler = self.compiler.profiler
+        if profiler != None:
+            start = time.perf_counter()
+
+        i = self.nr_instructions
+
+        self.nr_instructions += 1
+        prev_is_nlb = self.prev_is_nlb
+        prev_is_statement = self.prev_is_statement
+        self.prev_is_nlb = template.is_nlb
+        self.prev_is_statement = template.is_statement
+
+        # Don't print multiple newlines for NLB.
+        if i > 1:
+            if template.is_nlb:
+                if not prev_is_nlb:
+                    self.lines.append("")
+
+                if profiler != None:
+                    profiler.add(COMPILE, time.perf_counter() - start)
+                return
+
+        # Vertical spacing.
+        if template.is_statement or template.is_return:
+            if i > 1:
+                if not prev_is_statement and not prev_is_nlb:
+                    self.lines.append("")
+
+        # Set the indentation
+        compiled_line = "\t" * indent
+
+        # Compile each element of the instruction
+        compiled_line += " ".join(self.compiler.compile_element(element) for element in pre_compiled_elements)
+
+        if template.is_statement:
+            compiled_line += ":"
 
-        name = var_type + number
+        self.lines.append(compiled_line)
 
-        return name
\ No newline at end of file
+        if profiler != None:
+            profiler.add(COMPILE, time.perf_counter() - start)
@@ -0,0 +1,121 @@
+import json
+
+# Phases timed by Code, Scope & Compiler.
+FIND = "find_writable_instructions"
+SELECT = "select_instruction"
+PRECOMPILE = "precompile_instruction"
+REDUCE_INDENTATION = "Scope.reduce_indentation"   # Part of PRECOMPILE, as NLBs reduce indentation when pre-compiled.
+COMPILE = "compile"
+
+# Recorded distributions.
+WRITABLE_SET_SIZE = "writable_set_size"           # Number of writable instructions, per step.
+PROGRAM_LENGTH = "program_length"                 # Number of written instructions, per program.
+
+
+class Profiler():
+    """
+    Wall time and call counts per phase of writing, plus distributions of values.
+
+    Profiling is optional. Callers keep a reference that is None when disabled,
+    so a disabled profiler only costs a comparison per phase:
+
+        if self.profiler != None:
+            self.profiler.add(FIND, time.perf_counter() - start)
+
+    Distributions are kept as histograms, so their size does not grow with the
+    number of steps. Profilers of several workers can be merged into one.
+    """
+
+    def __init__(self):
+        self.seconds = {}         # Total wall time per phase, ex: {"compile": 0.5}
+        self.calls = {}           # Number of calls per phase
+        self.distributions = {}   # Histogram per distribution, ex: {"writable_set_size": {12: 40, 13: 2}}
+
+
+    def add(self, phase, seconds):
+        """
+        Add one call of a phase, which took seconds.
+        """
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+
+
+    def record(self, name, value):
+        """
+        Record one value of a distribution.
+        """
+        histogram = self.distributions.get(name)
+        if histogram == None:
+            histogram = {}
+            self.distributions[name] = histogram
+
+        histogram[value] = histogram.get(value, 0) + 1
+
+
+    def merge(self, other):
+        """
+        Add everything from another Profiler, or from its to_dict().
+        """
+        if isinstance(other, Profiler):
+            other = other.to_dict()
+
+        for phase, stats in other["phases"].items():
+            self.seconds[phase] = self.seconds.get(phase, 0.0) + stats["seconds"]
+            self.calls[phase] = self.calls.get(phase, 0) + stats["calls"]
+
+        for name, distribution in other["distributions"].items():
+            for value, count in distribution["histogram"].items():
+                histogram = self.distributions.setdefault(name, {})
+                histogram[int(value)] = histogram.get(int(value), 0) + count
+
+
+    def to_dict(self):
+        """
+        Return everything as a JSON serializable dict, with summaries of the distributions.
+        """
+        phases = {}
+        for phase, seconds in self.seconds.items():
+            calls = self.calls[phase]
+            phases[phase] = {"seconds": seconds, "calls": calls, "mean_seconds": seconds / calls}
+
+        distributions = {}
+        for name, histogram in self.distributions.items():
+            distributions[name] = summarize(histogram)
+
+        return {"phases": phases, "distributions": distributions}
+
+
+    def dump(self, path):
+        """
+        Write everything as JSON to file.
+        """
+        with open(path, "w") as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+
+def summarize(histogram):
+    """
+    Summarize a histogram of integer values: count, mean, min, max, percentiles & the histogram itself.
+    """
+    values = sorted(histogram)
+    count = sum(histogram.values())
+
+    percentiles = {}
+    seen = 0
+    for value in values:
+        seen += histogram[value]
+        for percentile in [50, 90, 99]:
+            key = "p" + str(percentile)
+            if key not in percentiles and seen * 100 >= count * percentile:
+                percentiles[key] = value
+
+    summary = {
+        "count": count,
+        "mean": sum(value * amount for value, amount in histogram.items()) / count,
+        "min": values[0],
+        "max": values[-1],
+    }
+    summary.update(percentiles)
+    summary["histogram"] = {str(value): histogram[value] for value in values}
+
+    return summary
@@ -0,0 +1,73 @@
+import collections
+import sys
+
+# Trace levels
+OFF = 0
+INFO = 1    # One line per written instruction.
+DEBUG = 2   # Dynamic elements and their replacements.
+TRACE = 3   # Everything, such as the elements of the instruction after pre-compilation.
+
+LEVELS = {
+    "off": OFF,
+    "info": INFO,
+    "debug": DEBUG,
+    "trace": TRACE,
+}
+
+
+class Tracer():
+    """
+    Leveled tracing of the decisions made while writing code.
+
+    Callers compare against tracer.level before building a message,
+    so a disabled level only costs an integer comparison:
+
+        if self.tracer.level >= DEBUG:
+            self.tracer.log("Dynamic Elements:", tokens)
+
+    Messages can be printed, kept in a ring buffer of the last buffer_size
+    messages, or both. The buffer can be dumped after the fact, ex: when
+    a bad program has been written.
+    """
+
+    def __init__(self, level=OFF, echo=True, buffer_size=0, stream=None):
+        self.level = level                  # Highest level that is traced.
+        self.echo = echo                    # Print messages as they are logged?
+        self.stream = stream                # Where to print messages, defaults to stdout.
+        self.buffer = None                  # The last buffer_size messages.
+
+        if buffer_size > 0:
+            self.buffer = collections.deque(maxlen=buffer_size)
+
+
+    def log(self, *parts):
+        """
+        Log a message, made up of parts joined like print() does.
+        Only call this after checking self.level.
+        """
+        message = " ".join(str(part) for part in parts)
+
+        if self.buffer != None:
+            self.buffer.append(message)
+
+        if self.echo:
+            print(message, file=self.stream if self.stream != None else sys.stdout)
+
+
+    def recent(self):
+        """
+        Return the buffered messages, oldest first.
+        """
+        if self.buffer == None:
+            return []
+
+        return list(self.buffer)
+
+
+    def dump(self, stream=None):
+        """
+        Write the buffered messages to a stream, defaults to stderr.
+        """
+        stream = stream if stream != None else sys.stderr
+        for message in self.recent():
+            stream.write(message + "\n")
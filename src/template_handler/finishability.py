@@ -0,0 +1,132 @@
+from src.code.elements.token import lex
+
+
+def provided_var_types(template):
+	"""
+	Variable types a template brings into scope, ex: "nvar<int> = <int>" => {"int"}.
+	Parameters of a def are in scope of its body. Loop variables ("for pvar<int> in ...")
+	are only in scope of the loop, so they are left out.
+	"""
+	var_types = set()
+	for element in template.elements:
+		if element.startswith("nvar"):
+			var_types.add(lex(element).type)
+
+		elif template.is_def and element.startswith("nfunc"):
+			var_types |= set(param.type for param in lex(element).params if param.kind == "pvar")
+
+	return var_types
+
+
+def signature(template):
+	"""
+	Signature of the function a def template defines, ex: ("int", ("int", "int")).
+	"""
+	token = lex(template.elements[1])
+
+	return (token.type, tuple(param.type for param in token.params if param.kind == "pvar"))
+
+
+def requirements_met(template, var_types, signatures):
+	"""
+	Can the requirements of a template be met, given the variable types in scope & callable signatures?
+	"""
+	for requirement in template.required_tokens:
+		token = lex(requirement)
+
+		if token.kind == "var":
+			if token.type not in var_types:
+				return False
+
+		else:
+			arg_types = tuple(param.type for param in token.params if param.is_variable())
+			if (token.type, arg_types) not in signatures:
+				return False
+
+			for arg_type in arg_types:
+				if arg_type not in var_types:
+					return False
+
+	return True
+
+
+def scope_var_types(templates, var_types, signatures):
+	"""
+	All variable types that can be brought into scope by writing the templates, starting from var_types.
+	"""
+	var_types = set(var_types)
+
+	changed = True
+	while changed:
+		changed = False
+		for template in templates:
+			if requirements_met(template, var_types, signatures):
+				provided = provided_var_types(template) - var_types
+				if len(provided) > 0:
+					var_types |= provided
+					changed = True
+
+	return var_types
+
+
+def can_follow_statements(templates, var_types, signatures):
+	"""
+	If any statement can be written, can a line that is not a statement (or return) follow it?
+	Otherwise the body of the statement could never be written.
+	"""
+	usable = [template for template in templates if requirements_met(template, var_types, signatures)]
+
+	if not any(template.is_statement and not template.is_def for template in usable):
+		return True
+
+	return any(not template.is_statement and not template.is_return for template in usable)
+
+
+def is_finishable(templates):
+	"""
+	Can code written from the templates always be finished, whatever is selected?
+
+	A written def has to be closed, which takes a return with its requirements met in
+	the function body, and every statement needs a line that can follow it. The body
+	of a function only counts on its parameters & variables declared in the body,
+	as nothing else is sure to be written before the def. Templates that can never be
+	written, as their requirements can never be met, do no harm.
+
+	Ex: "def nfunc<int>()" & "return {{var<int>}}" is not finishable without "nvar<int> = <int>".
+	"""
+	templates = [template for template in templates if not template.is_nlb]
+
+	defs = [template for template in templates if template.is_def]
+	body_templates = [template for template in templates if not template.is_def]
+	top_level_templates = [template for template in body_templates if not template.must_be_in_function]
+
+	# Functions that can be closed are callable once defined, which may make more functions closable.
+	signatures = set()
+	while True:
+		var_types = scope_var_types(top_level_templates, set(), signatures)
+
+		finishable_signatures = set()
+		for template in defs:
+			if not requirements_met(template, var_types, signatures):
+				continue
+
+			# Functions without a return (void) can never be exited.
+			if lex(template.elements[1]).type == "void":
+				return False
+
+			body_var_types = scope_var_types(body_templates, provided_var_types(template), signatures)
+
+			if not any(template.is_return and requirements_met(template, body_var_types, signatures) for template in body_templates):
+				return False
+
+			if not can_follow_statements(body_templates, body_var_types, signatures):
+				return False
+
+			finishable_signatures.add(signature(template))
+
+		if finishable_signatures <= signatures:
+			break
+
+		signatures |= finishable_signatures
+
+	return can_follow_statements(top_level_templates, var_types, signatures)
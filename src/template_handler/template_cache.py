@@ -0,0 +1,99 @@
+from src.template_handler.template_handler import TemplateHandler, EXPANSION_VERSION
+from src.code.elements.instruction import Instruction
+
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+
+class TemplateCache():
+	"""
+	On-disk cache of expanded and parsed templates.
+
+	Entries are keyed by a hash of the template generator file contents and
+	EXPANSION_VERSION, so expansion is skipped entirely when nothing has changed.
+	Each entry is a single pickle of the parsed Template objects, loaded in one read.
+	"""
+
+	def __init__(self, directory="templates/cache"):
+		self.directory = directory
+		self.last_hit = None   # Was the last load served from the cache (warm) or expanded (cold)?
+		self.last_time = None  # Seconds spent by the last load.
+		self.last_count = None # Number of templates loaded by the last load.
+
+	def key(self, generator_path):
+		"""
+		Content hash identifying the templates of a generator file.
+		"""
+		digest = hashlib.sha256()
+		digest.update(("expansion-" + str(EXPANSION_VERSION) + "\n").encode())
+
+		with open(generator_path, "rb") as file:
+			digest.update(file.read())
+
+		return digest.hexdigest()
+
+	def path(self, generator_path):
+		"""
+		Path of the cache entry for a generator file.
+		"""
+		return os.path.join(self.directory, self.key(generator_path) + ".pickle")
+
+	def load_instructions(self, generator_path):
+		"""
+		Return instruction objects for a generator file, from the cache if possible.
+		Otherwise the templates are expanded and the cache entry is written.
+		"""
+		start = time.perf_counter()
+
+		path = self.path(generator_path)
+		templates = self.read(path)
+
+		self.last_hit = templates != None
+
+		if templates == None:
+			th = TemplateHandler()
+			th.load_template_generators(generator_path)
+			templates = [instruction.parsed_template for instruction in th.create_instructions()]
+			self.write(path, templates)
+
+		instructions = [Instruction(template) for template in templates]
+
+		self.last_time = time.perf_counter() - start
+		self.last_count = len(templates)
+
+		return instructions
+
+	def read(self, path):
+		"""
+		Read the Template objects of a cache entry. Returns None if missing or unreadable.
+		"""
+		try:
+			with open(path, "rb") as file:
+				return pickle.load(file)
+
+		except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+			return None
+
+	def write(self, path, templates):
+		"""
+		Write a cache entry. The entry is replaced atomically, so
+		concurrent readers never see a partially written file.
+		"""
+		os.makedirs(self.directory, exist_ok=True)
+
+		fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+		with os.fdopen(fd, "wb") as file:
+			pickle.dump(templates, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+		os.replace(temp_path, path)
+
+	def report(self):
+		"""
+		Describe the last load, ex: "Startup (warm): 38 templates in 0.41 ms".
+		"""
+		if self.last_hit == None:
+			return "Startup: nothing loaded"
+
+		return "Startup (" + ("warm" if self.last_hit else "cold") + "): " + str(self.last_count) + " templates in " + str(round(self.last_time * 1000, 2)) + " ms"
@@ -0,0 +1,264 @@
+import bisect
+import itertools
+import re
+
+
+class Sequence():
+	"""
+	A run of static text and choices, ex: "range({{<int>|var<int>}})".
+	Every element of a generator line, and every alternative of a choice, is a sequence.
+	"""
+
+	def __init__(self, parts, text, has_choice):
+		self.parts = parts            # Tuple of static strings & Choice objects, in order.
+		self.text = text              # The source text of the sequence.
+		self.has_choice = has_choice  # Does the sequence have any options?
+
+
+class Choice():
+	"""
+	Options separated by "|" inside of {{}}, ex: "{{+=|-=}}". Options may contain choices themselves.
+	"""
+
+	def __init__(self, alternatives, text):
+		self.alternatives = alternatives  # Tuple of Sequence objects, in order.
+		self.text = text                  # The source text of the choice, including the braces.
+
+
+# Delimiters of choices. Everything between them is static text.
+DELIMITERS = re.compile(r"({{|}}|\|)")
+
+
+def parse(text):
+	"""
+	Parse an element of a generator line into a grammar tree, in a single pass
+	over the text split at the delimiters.
+	"""
+	sequence, index = parse_sequence(DELIMITERS.split(text), 0, False, text)
+
+	return sequence
+
+
+def parse_sequence(pieces, index, in_choice, source):
+	"""
+	Parse a sequence starting at pieces[index]. Inside of a choice, the sequence ends at a
+	"|" or "}}" on its own level. Returns the sequence and the index after it.
+	"""
+	parts = []
+	texts = []
+	literal = []
+	has_choice = False
+
+	while index < len(pieces):
+		piece = pieces[index]
+
+		if piece == "{{":
+			if len(literal) > 0:
+				parts.append("".join(literal))
+				literal = []
+
+			choice, index = parse_choice(pieces, index, source)
+			parts.append(choice)
+			has_choice = True
+			texts.append(choice.text)
+			continue
+
+		if in_choice and (piece == "|" or piece == "}}"):
+			break
+
+		if piece != "":
+			literal.append(piece)
+			texts.append(piece)
+
+		index += 1
+
+	if in_choice and index >= len(pieces):
+		raise Exception("TemplateGrammar: Missing }} in " + source)
+
+	if len(literal) > 0:
+		parts.append("".join(literal))
+
+	return Sequence(tuple(parts), "".join(texts), has_choice), index
+
+
+def parse_choice(pieces, index, source):
+	"""
+	Parse a choice starting at the "{{" at pieces[index]. Returns the choice and the index after it.
+	"""
+	index += 1
+
+	alternatives = []
+	while True:
+		alternative, index = parse_sequence(pieces, index, True, source)
+		alternatives.append(alternative)
+
+		index += 1
+		if pieces[index - 1] == "}}":
+			break
+
+	text = "{{" + "|".join(alternative.text for alternative in alternatives) + "}}"
+
+	return Choice(tuple(alternatives), text), index
+
+
+def wrap_dynamic(option):
+	"""
+	Mark an option of a choice as dynamic if it is a variable or value, ex: "var<int>" => "{{var<int>}}".
+	Comma separated options are marked one by one, ex: "<int>,<int>" => "{{<int>}},{{<int>}}".
+	"""
+	if option.startswith("var") or re.match(r"<.*?>", option):
+		return ",".join("{{" + part + "}}" for part in option.split(","))
+
+	return option
+
+
+class TemplateExpander():
+	"""
+	Expand elements of generator lines into all their permutations.
+
+	Every distinct element is parsed once, and every distinct sub-expression is
+	expanded once and reused, ex: "{{var<int>|<int>}}" appears in many lines.
+	Expansion only builds each output string once, so the time scales with the output.
+
+	Permutations can also be counted and decoded one at a time, without expanding
+	anything: decode_sequence(sequence, k) is expand_sequence(sequence)[k].
+	"""
+
+	def __init__(self):
+		self.parsed = {}      # Element text => Sequence
+		self.expansions = {}  # Memoized expansions: (kind, text, ...) => tuple of strings
+		self.counts = {}      # Memoized number of permutations: (kind, text) => int
+		self.offsets = {}     # Choice text => index of the first permutation of each alternative
+
+	def parse(self, element):
+		sequence = self.parsed.get(element)
+		if sequence == None:
+			sequence = parse(element)
+			self.parsed[element] = sequence
+
+		return sequence
+
+	def element_permutations(self, element):
+		"""
+		Return all permutations of an element of a generator line, in order.
+		"""
+		return self.expand_sequence(self.parse(element))
+
+	def expand_sequence(self, sequence):
+		key = ("sequence", sequence.text)
+		permutations = self.expansions.get(key)
+		if permutations != None:
+			return permutations
+
+		# Options of function definitions/calls are parameters & arguments, and are not marked as dynamic.
+		wrap = not (sequence.text.startswith("nfunc") or sequence.text.startswith("func"))
+
+		options = []
+		for part in sequence.parts:
+			if isinstance(part, Choice):
+				options.append(self.expand_choice(part, wrap))
+			else:
+				options.append((part,))
+
+		permutations = tuple("".join(permutation) for permutation in itertools.product(*options))
+
+		# A function call with options is a dynamic element of its own.
+		if sequence.has_choice:
+			permutations = tuple("{{" + permutation + "}}" if permutation.startswith("func") else permutation for permutation in permutations)
+
+		self.expansions[key] = permutations
+
+		return permutations
+
+	def expand_choice(self, choice, wrap):
+		key = ("choice", choice.text, wrap)
+		permutations = self.expansions.get(key)
+		if permutations != None:
+			return permutations
+
+		options = []
+		for alternative in choice.alternatives:
+			# Most alternatives are static text, which is its only permutation.
+			if not alternative.has_choice:
+				options.append(wrap_dynamic(alternative.text) if wrap else alternative.text)
+				continue
+
+			for permutation in self.expand_sequence(alternative):
+				options.append(wrap_dynamic(permutation) if wrap else permutation)
+
+		permutations = tuple(options)
+		self.expansions[key] = permutations
+
+		return permutations
+
+	def count_sequence(self, sequence):
+		"""
+		Return the number of permutations of a sequence, without expanding it.
+		"""
+		key = ("sequence", sequence.text)
+		count = self.counts.get(key)
+		if count != None:
+			return count
+
+		count = 1
+		for part in sequence.parts:
+			if isinstance(part, Choice):
+				count *= self.count_choice(part)
+
+		self.counts[key] = count
+
+		return count
+
+	def count_choice(self, choice):
+		key = ("choice", choice.text)
+		count = self.counts.get(key)
+		if count != None:
+			return count
+
+		offsets = []
+		count = 0
+		for alternative in choice.alternatives:
+			offsets.append(count)
+			count += self.count_sequence(alternative) if alternative.has_choice else 1
+
+		self.offsets[choice.text] = offsets
+		self.counts[key] = count
+
+		return count
+
+	def decode_sequence(self, sequence, k):
+		"""
+		Return the k-th permutation of a sequence, in the order of expand_sequence().
+		The index is decoded in mixed radix over the choices, the last choice varying fastest.
+		"""
+		wrap = not (sequence.text.startswith("nfunc") or sequence.text.startswith("func"))
+
+		pieces = []
+		for part in reversed(sequence.parts):
+			if isinstance(part, Choice):
+				k, index = divmod(k, self.count_choice(part))
+				pieces.append(self.decode_choice(part, wrap, index))
+			else:
+				pieces.append(part)
+
+		permutation = "".join(reversed(pieces))
+
+		if sequence.has_choice and permutation.startswith("func"):
+			permutation = "{{" + permutation + "}}"
+
+		return permutation
+
+	def decode_choice(self, choice, wrap, k):
+		self.count_choice(choice)
+		offsets = self.offsets[choice.text]
+
+		# The alternative holding the k-th permutation.
+		index = bisect.bisect_right(offsets, k) - 1
+		alternative = choice.alternatives[index]
+
+		if alternative.has_choice:
+			option = self.decode_sequence(alternative, k - offsets[index])
+		else:
+			option = alternative.text
+
+		return wrap_dynamic(option) if wrap else option
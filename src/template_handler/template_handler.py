@@ -1,13 +1,24 @@
 from src.code.elements.instruction import Instruction
+from src.code.elements.template import Template
+from src.template_handler.template_grammar import TemplateExpander
+from src.template_handler.template_space import TemplateSpace, TemplateSpaces
+from src.template_handler.finishability import is_finishable
 
 import itertools
-import re
+
+# Version of the template expansion and of the parsed Template format.
+# Bump this whenever either changes, as it invalidates all cached templates.
+# 2: Elements are parsed into grammar trees, which also expands elements with several options correctly.
+EXPANSION_VERSION = 2
+
+# Number of times to sample templates before giving up on finding a finishable set.
+MAX_SAMPLE_ATTEMPTS = 1000
 
 class TemplateHandler():
 
 	def __init__(self):
 		self.template_generators = [] # Template Generators represented as splitted lists
-		self.templates = []
+		self.expander = TemplateExpander() # Parses & expands elements, reusing identical sub-expressions
 
 	def load_template_generators(self, path):
 		"""Load Generators used to create all template permutations"""
@@ -20,20 +31,29 @@ class TemplateHandler():
 	def generate_templates(self):
 		"""
 		Generate template permutations from loaded template generators.
+		This is a generator, so the templates are never all held in memory at once.
 		"""
 		for generator in self.template_generators:
-			self.templates.extend(self.expand(generator))
+			yield from self.expand(generator)
 
 	def save_templates(self, path):
-		"""Save loaded/generated templates to file"""
+		"""
+		Generate templates and stream them straight to file.
+		Returns the number of templates written.
+		"""
+		count = 0
 		with open(path, "w+") as file:
-			for template in self.templates:
+			for template in self.generate_templates():
 				template_str = ' '.join(template) + "\n"
 				file.write(template_str)
+				count += 1
+
+		return count
 
-	def create_instructions(self, path):
+	def create_instructions(self, path=None):
 		"""
 		Load instructions from .tmpl-file and generate instruction objects.
+		Without a path, the instructions are created directly from the generated templates.
 		"""
 		instructions = []
 
@@ -41,14 +61,55 @@ class TemplateHandler():
 		instruction = Instruction("nlb")
 		instructions.append(instruction)
 
+		if path == None:
+			for template in self.generate_templates():
+				instructions.append(Instruction(' '.join(template)))
+
+			return instructions
+
 		with open(path, "r") as file:
-			for line in file.readlines():
+			for line in file:
 				instruction = Instruction(line.strip("\n"))
 				instructions.append(instruction)
 
 		return instructions
 
 
+	def template_spaces(self):
+		"""
+		Return the loaded template generators as lazy template spaces, without expanding them.
+		"""
+		return TemplateSpaces([TemplateSpace(generator, self.expander) for generator in self.template_generators])
+
+	def count_templates(self):
+		"""
+		Return the number of template permutations of the loaded generators, without expanding them.
+		"""
+		return self.template_spaces().size
+
+	def create_sampled_instructions(self, number, rng):
+		"""
+		Generate instruction objects for number templates sampled uniformly from all
+		permutations of the loaded generators, drawn from the numpy Generator rng.
+
+		Samples that can not always be written to a finished program are rejected and
+		sampled again, see is_finishable(). Ex: a def whose body can never return.
+		"""
+		spaces = self.template_spaces()
+
+		for _ in range(MAX_SAMPLE_ATTEMPTS):
+			templates = [Template(' '.join(template)) for template in spaces.sample(rng, number)]
+
+			if is_finishable(templates):
+				instructions = [Instruction("nlb")]
+				for template in templates:
+					instructions.append(Instruction(template))
+
+				return instructions
+
+		raise Exception("TemplateHandler: Could not sample " + str(number) + " templates that can finish a program in " + str(MAX_SAMPLE_ATTEMPTS) + " attempts.")
+
+
 	def load_existing_templates(self, path):
 		"""Load previously generated templates"""
 		pass
@@ -57,6 +118,7 @@ class TemplateHandler():
 	def expand(self, template):
 		"""
 		Gather permutations from a specific Template Generator.
+		Permutations are yielded one by one as lists of elements.
 		"""
 
 		# Make each element a list so we can figure out permutations.
@@ -74,96 +136,17 @@ class TemplateHandler():
 				# Multiple options of tokens.
 				# Find all permutations of the element.
 				# func(|var<int>) becomes [func(), func(var<int>)]
-				element_permutations = self.generate_element_permutations(element)
+				element_permutations = self.expander.element_permutations(element)
 				instruction_parts.append(element_permutations)
 
-		# Now find all permutations of the template
-		permutations = []
+		# Now find all permutations of the template.
+		# Only the options of each element are held in memory, never the whole product.
 		for template_permutation in itertools.product(*instruction_parts):
-			permutations.append(list(template_permutation))
-
-		return permutations
+			yield list(template_permutation)
 
 
 	def generate_element_permutations(self, element):
 		"""
 		Generate all permutations of an instruction element.
 		"""
-		permutation_parts = []
-		for idx, dynamic in enumerate(re.findall(r"{{(.*)}}", element)):
-			tokens = self.extract_tokens(dynamic)
-
-			# Create Deep Permutations
-			for i, token in enumerate(tokens):
-				if "{{" in token:
-					token_permutations = self.generate_element_permutations(token)
-					del tokens[i]
-					tokens.extend(token_permutations)
-
-			element = element.replace("{{" + dynamic + "}}", "[[" + str(idx) + "]]", 1)
-
-			permutation_parts.append(tokens)
-
-		permutations = []
-		for template_permutation in itertools.product(*permutation_parts):
-			permutation = element
-			for i in range(len(template_permutation)):
-
-				repl = template_permutation[i]
-				if not permutation.startswith("nfunc") and not permutation.startswith("func"):  
-					if repl.startswith("var") or bool(re.match(r"<.*?>", repl)):                     
-						if "," in repl:
-							repls = repl.split(",")
-							repl = ','.join(["{{" + elem + "}}" for elem in repls])
-						else:
-							repl = "{{" + repl + "}}"
-
-				#DEBUG
-				# print("replacing", "[[" + str(i) + "]]", "in", permutation, "with", repl)
-
-				permutation = permutation.replace("[[" + str(i) + "]]", repl)
-
-			if permutation.startswith("func"):
-				permutation = "{{" + permutation + "}}"
-
-			permutations.append(permutation)
-		
-		return permutations
-
-
-	def extract_tokens(self, dynamic_part):
-		"""
-		Get all variations of dynamic parts in an element.
-		"""
-		tokens = []
-		for token in self.optsplit(dynamic_part):
-			tokens.append(token)
-
-		return tokens
-
-
-	def optsplit(self, string):
-		"""
-		Split options in string separated by "|".
-		Do not split on "|" when inside of multivalue: {{}}
-		"""
-		parts = string.split("|")
-
-		filtered_parts = []
-		combo_parts = []
-		for part in parts:
-			if "{{" in part:
-				combo_parts.append(part)
-			
-			elif "}}" in part:
-				combo_parts.append(part)
-				filtered_parts.append("|".join(combo_parts))
-				combo_parts = []
-
-			elif len(combo_parts) == 0:
-				filtered_parts.append(part)
-
-			else:
-				combo_parts.append(part)
-
-		return filtered_parts
\ No newline at end of file
+		return list(self.expander.element_permutations(element))
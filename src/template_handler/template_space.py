@@ -0,0 +1,123 @@
+import bisect
+
+
+def random_index(rng, size):
+	"""
+	Draw an index in [0, size) uniformly from a numpy Generator, for sizes of any magnitude.
+	"""
+	if size <= 0:
+		raise ValueError("TemplateSpace: Can not sample from an empty space.")
+
+	if size < 2 ** 63:
+		return int(rng.integers(size))
+
+	# Too large for numpy integers: draw enough random bits and reject values out of range.
+	nr_bits = (size - 1).bit_length()
+	nr_bytes = (nr_bits + 7) // 8
+	while True:
+		index = int.from_bytes(rng.bytes(nr_bytes), "little") >> (nr_bytes * 8 - nr_bits)
+		if index < size:
+			return index
+
+
+class TemplateSpace():
+	"""
+	All template permutations of one generator line, as a compact product space.
+
+	Each element is kept as its grammar tree, and only the number of permutations
+	of every element is computed. The space has as many templates as the product
+	of those, and the k-th template is decoded on demand, in the same order as
+	TemplateHandler.expand() yields them. Nothing is ever enumerated.
+	"""
+
+	def __init__(self, generator, expander):
+		self.generator = generator  # The generator line, split into elements.
+		self.expander = expander    # TemplateExpander parsing & decoding the elements.
+		self.elements = []          # Fixed element strings, or Sequence objects of elements with options.
+		self.radices = []           # Number of permutations of each element.
+		self.size = 1               # Number of templates in the space.
+
+		for element in generator:
+			if not "{{" in element:
+				if element.startswith("var") or element.startswith("<"):
+					element = "{{" + element + "}}"
+
+				self.elements.append(element)
+				self.radices.append(1)
+
+			else:
+				sequence = expander.parse(element)
+				self.elements.append(sequence)
+				self.radices.append(expander.count_sequence(sequence))
+
+			self.size *= self.radices[-1]
+
+	def decode(self, k):
+		"""
+		Return the k-th template of the space as a list of elements.
+		"""
+		if k < 0 or k >= self.size:
+			raise IndexError("TemplateSpace: Template " + str(k) + " out of range for " + str(self.size) + " templates.")
+
+		# Mixed radix, the last element varying fastest as in itertools.product.
+		template = [None] * len(self.elements)
+		for position in range(len(self.elements) - 1, -1, -1):
+			element = self.elements[position]
+
+			if isinstance(element, str):
+				template[position] = element
+			else:
+				k, index = divmod(k, self.radices[position])
+				template[position] = self.expander.decode_sequence(element, index)
+
+		return template
+
+	def sample(self, rng):
+		"""
+		Return a uniformly sampled template of the space as a list of elements.
+		"""
+		return self.decode(random_index(rng, self.size))
+
+
+class TemplateSpaces():
+	"""
+	The template spaces of all generator lines of a file, addressed as one space.
+	Template k of the whole is in the line whose range of indices holds k, in file order.
+	"""
+
+	def __init__(self, spaces):
+		self.spaces = spaces  # TemplateSpace of each generator line.
+		self.offsets = []     # Index of the first template of each line.
+		self.size = 0         # Number of templates of all lines together.
+
+		for space in spaces:
+			self.offsets.append(self.size)
+			self.size += space.size
+
+	def decode(self, k):
+		"""
+		Return the k-th template of all lines as a list of elements.
+		"""
+		if k < 0 or k >= self.size:
+			raise IndexError("TemplateSpaces: Template " + str(k) + " out of range for " + str(self.size) + " templates.")
+
+		line = bisect.bisect_right(self.offsets, k) - 1
+
+		return self.spaces[line].decode(k - self.offsets[line])
+
+	def sample(self, rng, number):
+		"""
+		Return number distinct templates, sampled uniformly over all lines without replacement.
+		Lines with more permutations are weighted accordingly. The templates keep their
+		relative order of full expansion. With number >= size, every template is returned.
+		"""
+		if number >= self.size:
+			indices = range(self.size)
+		else:
+			indices = set()
+			while len(indices) < number:
+				indices.add(random_index(rng, self.size))
+
+			indices = sorted(indices)
+
+		return [self.decode(k) for k in indices]
@@ -0,0 +1,122 @@
+from src.template_handler.template_handler import TemplateHandler
+from src.code.code import Code
+from src.code.instruction_index import InstructionIndex
+from src.code.program_archive import ProgramArchiveWriter, ProgramArchive, pytmpl_to_archive, archive_to_pytmpl
+from src.compiler.compiler import Compiler
+
+import numpy as np
+import os
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_programs(count):
+    """
+    Write count seeded programs from the main template generators.
+    """
+    handler = TemplateHandler()
+    handler.load_template_generators(os.path.join(ROOT, "template_generators", "main.txt"))
+    instructions = handler.create_instructions()
+    index = InstructionIndex(instructions)
+
+    codes = []
+    for number in range(count):
+        code = Code(instructions, index, rng=np.random.default_rng([0, number]))
+        code.write()
+        codes.append(code)
+
+    return codes
+
+
+def program_lines(code):
+    return [str(instruction) for instruction in code.written_instructions]
+
+
+def test_roundtrip(tmp_path):
+    path = str(tmp_path / "programs.arc")
+    codes = write_programs(50)
+
+    # A program without lines in between the others.
+    codes.insert(25, Code([]))
+
+    with ProgramArchiveWriter(path) as writer:
+        for code in codes:
+            writer.add_code(code)
+
+    archive = ProgramArchive(path)
+    assert len(archive) == len(codes)
+
+    for number, code in enumerate(codes):
+        assert archive[number] == program_lines(code)
+
+        loaded = archive.load_into(Code([]), number)
+        assert Compiler().compile(loaded) == Compiler().compile(code)
+
+    assert archive[25] == []
+    assert archive[-1] == program_lines(codes[-1])
+
+    with pytest.raises(IndexError):
+        archive[len(codes)]
+
+
+def test_empty_archive(tmp_path):
+    path = str(tmp_path / "empty.arc")
+
+    with ProgramArchiveWriter(path):
+        pass
+
+    archive = ProgramArchive(path)
+    assert len(archive) == 0
+
+    with pytest.raises(IndexError):
+        archive[0]
+
+
+def test_only_empty_programs(tmp_path):
+    path = str(tmp_path / "empty-programs.arc")
+
+    with ProgramArchiveWriter(path) as writer:
+        writer.add_program([])
+        writer.add_program([])
+
+    archive = ProgramArchive(path)
+    assert len(archive) == 2
+    assert archive[0] == [] and archive[1] == []
+
+
+def test_pytmpl_conversion(tmp_path):
+    paths = []
+    for number, code in enumerate(write_programs(10)):
+        path = str(tmp_path / ("program" + str(number) + ".pytmpl"))
+        code.save_to_file(path)
+        paths.append(path)
+
+    archive_path = str(tmp_path / "programs.arc")
+    assert pytmpl_to_archive(paths, archive_path) == len(paths)
+
+    out_paths = archive_to_pytmpl(archive_path, str(tmp_path / "out"))
+    assert len(out_paths) == len(paths)
+
+    for path, out_path in zip(paths, out_paths):
+        with open(path, "r") as file, open(out_path, "r") as out_file:
+            assert out_file.read() == file.read()
+
+
+def test_failed_write_leaves_no_archive(tmp_path):
+    path = str(tmp_path / "failed.arc")
+
+    with pytest.raises(RuntimeError):
+        with ProgramArchiveWriter(path) as writer:
+            writer.add_program(["int0 = 3"])
+            raise RuntimeError()
+
+    assert not os.path.exists(path)
+
+
+def test_not_an_archive(tmp_path):
+    path = tmp_path / "program.pytmpl"
+    path.write_text("int0 = 3\n")
+
+    with pytest.raises(Exception, match="not a program archive"):
+        ProgramArchive(str(path))
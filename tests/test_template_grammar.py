@@ -0,0 +1,53 @@
+from src.template_handler.template_handler import TemplateHandler
+
+import pytest
+
+
+def permutations(element):
+    return TemplateHandler().generate_element_permutations(element)
+
+
+def test_options():
+    assert permutations("{{+=|-=}}") == ["+=", "-="]
+    assert permutations("{{var<int>|<int>}}") == ["{{var<int>}}", "{{<int>}}"]
+
+
+def test_nested_options():
+    assert permutations("range({{<int>|var<int>,var<int>|len({{var<int[]>|var<float[]>}})}})") == [
+        "range({{<int>}})",
+        "range({{var<int>}},{{var<int>}})",
+        "range(len({{var<int[]>}}))",
+        "range(len({{var<float[]>}}))",
+    ]
+
+
+def test_several_options_in_one_element():
+    assert permutations("{{var<int[]>}}.append({{<int>|var<int>}})") == [
+        "{{var<int[]>}}.append({{<int>}})",
+        "{{var<int[]>}}.append({{var<int>}})",
+    ]
+
+    assert permutations("{{a|b{{c|d}}}}{{x|y}}") == ["ax", "ay", "bcx", "bcy", "bdx", "bdy"]
+
+
+def test_functions():
+    # Calls are dynamic as a whole, and their arguments are not marked.
+    assert permutations("func<int>({{|var<int>|var<int>,var<int>}})") == [
+        "{{func<int>()}}",
+        "{{func<int>(var<int>)}}",
+        "{{func<int>(var<int>,var<int>)}}",
+    ]
+
+    assert permutations("nfunc<int>({{|pvar<int>}})") == ["nfunc<int>()", "nfunc<int>(pvar<int>)"]
+
+
+def test_expand():
+    assert list(TemplateHandler().expand(["if", "var<int>", "{{<|>}}", "<int>"])) == [
+        ["if", "{{var<int>}}", "<", "{{<int>}}"],
+        ["if", "{{var<int>}}", ">", "{{<int>}}"],
+    ]
+
+
+def test_missing_closing_braces():
+    with pytest.raises(Exception, match="Missing }}"):
+        permutations("{{a|b")
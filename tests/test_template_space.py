@@ -0,0 +1,132 @@
+from src.template_handler.template_handler import TemplateHandler
+from src.template_handler.template_space import random_index
+from src.template_handler.finishability import is_finishable
+from src.code.elements.template import Template
+from src.code.code import Code
+from src.compiler.compiler import Compiler
+
+import glob
+import numpy as np
+import os
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GENERATOR_FILES = sorted(glob.glob(os.path.join(ROOT, "template_generators", "*.txt")) + glob.glob(os.path.join(ROOT, "benchmarks", "generators", "*.txt")))
+
+# Lines with nested options and several options per element.
+NESTED_LINES = [
+    "var<int> = func<int>({{|var<int>|var<int>,var<int>}}) {{+|-}} {{var<int>|<int>|len({{var<int[]>|var<float[]>}})}}",
+    "{{var<int[]>}}.append({{<int>|var<int>|len({{var<int[]>|{{a|b}}c}})}}) {{x|y{{p|q}}}}",
+    "for {{_|pvar<int>}} in range({{<int>|var<int>|<int>,<int>|var<int>,var<int>|len({{var<int[]>|var<float[]>}})}})",
+]
+
+
+def load(path=None, lines=None, tmp_path=None):
+    if lines != None:
+        path = str(tmp_path / "generators.txt")
+        with open(path, "w") as file:
+            file.write("\n".join(lines) + "\n")
+
+    handler = TemplateHandler()
+    handler.load_template_generators(path)
+
+    return handler
+
+
+def assert_decodes_expansion(handler):
+    templates = list(handler.generate_templates())
+    spaces = handler.template_spaces()
+
+    assert spaces.size == len(templates) == handler.count_templates()
+    assert [spaces.decode(k) for k in range(spaces.size)] == templates
+
+
+@pytest.mark.parametrize("path", GENERATOR_FILES, ids=os.path.basename)
+def test_decode_generator_files(path):
+    assert_decodes_expansion(load(path))
+
+
+def test_decode_nested_lines(tmp_path):
+    assert_decodes_expansion(load(lines=NESTED_LINES, tmp_path=tmp_path))
+
+
+def test_decode_out_of_range(tmp_path):
+    spaces = load(lines=NESTED_LINES, tmp_path=tmp_path).template_spaces()
+
+    with pytest.raises(IndexError):
+        spaces.decode(spaces.size)
+
+    with pytest.raises(IndexError):
+        spaces.spaces[0].decode(-1)
+
+
+def test_sample(tmp_path):
+    handler = load(lines=NESTED_LINES, tmp_path=tmp_path)
+    templates = list(handler.generate_templates())
+    spaces = handler.template_spaces()
+
+    sampled = spaces.sample(np.random.default_rng(0), 10)
+    positions = [templates.index(template) for template in sampled]
+
+    # Distinct, in the order of full expansion.
+    assert len(sampled) == 10
+    assert positions == sorted(set(positions))
+
+    assert spaces.sample(np.random.default_rng(0), spaces.size + 1) == templates
+
+
+def test_huge_space(tmp_path):
+    line = " ".join("{{var<int>|<int>|" + str(i) + "}}" for i in range(50))
+    spaces = load(lines=[line], tmp_path=tmp_path).template_spaces()
+
+    assert spaces.size == 3 ** 50
+    assert spaces.decode(spaces.size - 1) == [str(i) for i in range(50)]
+
+    rng = np.random.default_rng(0)
+    for _ in range(100):
+        assert 0 <= random_index(rng, spaces.size) < spaces.size
+
+    assert len(spaces.sample(rng, 5)) == 5
+
+
+def templates(*strings):
+    return [Template(string) for string in strings]
+
+
+def test_is_finishable():
+    assert is_finishable(templates("nvar<int> = <int>", "if {{var<int>}} < {{<int>}}"))
+    assert is_finishable(templates("def nfunc<int>(pvar<int>)", "return {{var<int>}}"))
+    assert is_finishable(templates("def nfunc<int>()", "nvar<int> = <int>", "return {{var<int>}}"))
+
+    # The body of the function can never return.
+    assert not is_finishable(templates("def nfunc<int>()"))
+    assert not is_finishable(templates("def nfunc<int>()", "return {{var<int>}}"))
+    assert not is_finishable(templates("def nfunc<void>(pvar<int>)", "{{var<int>}} = {{<int>}}"))
+
+    # Nothing but a return, which is not allowed inside the if, can follow the statement.
+    assert not is_finishable(templates("def nfunc<int>(pvar<int>)", "return {{var<int>}}", "if {{var<int>}} < {{<int>}}"))
+
+    # Templates whose requirements can never be met are never written.
+    assert is_finishable(templates("if {{var<int>}} < {{<int>}}"))
+    assert is_finishable(templates("nvar<int> = <int>", "{{var<int>}} = {{func<int>(var<bool>)}}"))
+
+    handler = load(os.path.join(ROOT, "template_generators", "main.txt"))
+    assert is_finishable([instruction.parsed_template for instruction in handler.create_instructions()])
+
+
+@pytest.mark.parametrize("number", [1, 3, 5, 20])
+def test_sampled_programs_finish(number):
+    handler = load(os.path.join(ROOT, "template_generators", "main.txt"))
+
+    for seed in range(10):
+        rng = np.random.default_rng(seed)
+        instructions = handler.create_sampled_instructions(number, rng)
+        assert is_finishable([instruction.parsed_template for instruction in instructions])
+
+        code = Code(instructions, rng=rng)
+        code.write()
+        assert len(code.written_instructions) == 0 or code.is_endable()
+
+        source = "\n".join(Compiler().compile(code)) + "\n"
+        exec(compile(source, "sampled", "exec"), {})
@@ -0,0 +1,71 @@
+from src.template_handler.template_handler import TemplateHandler
+from src.code.code import Code
+
+import numpy as np
+import os
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GENERATOR_FILES = [
+    os.path.join(ROOT, "template_generators", "main.txt"),
+    os.path.join(ROOT, "benchmarks", "generators", "small.txt"),
+    os.path.join(ROOT, "benchmarks", "generators", "large.txt"),
+]
+
+
+def arguments(kind, count):
+    return ",".join([kind + "<int>"] * count)
+
+
+# Defs & calls of 70 signatures, more than fit in one 64 bit word of the masks.
+WIDE_LINES = [
+    "nvar<int> = <int>",
+    "var<int> = var<int> + <int>",
+    "return var<int>",
+    "def nfunc<int>({{" + "|".join(arguments("pvar", count) for count in range(70)) + "}})",
+    "nvar<int> = func<int>({{" + "|".join(arguments("var", count) for count in range(70)) + "}})",
+]
+
+
+def load_instructions(path):
+    handler = TemplateHandler()
+    handler.load_template_generators(path)
+
+    return handler.create_instructions()
+
+
+def assert_masks_match_checks(instructions, seeds):
+    """
+    Write seeded programs, and check that the masks and the checks agree on every step.
+    """
+    for seed in range(seeds):
+        code = Code(instructions, rng=np.random.default_rng(seed))
+        assert code.use_masks
+
+        while True:
+            writable_ids = code.find_writable_instructions()
+            assert np.array_equal(writable_ids, code.check_writable_groups())
+
+            instruction = code.select_instruction(writable_ids)
+            if instruction == None:
+                break
+
+            code.write_instruction(instruction)
+
+    return code
+
+
+@pytest.mark.parametrize("path", GENERATOR_FILES, ids=os.path.basename)
+def test_masks_match_checks(path):
+    assert_masks_match_checks(load_instructions(path), 30)
+
+
+def test_masks_match_checks_over_several_words(tmp_path):
+    path = str(tmp_path / "wide.txt")
+    with open(path, "w") as file:
+        file.write("\n".join(WIDE_LINES) + "\n")
+
+    code = assert_masks_match_checks(load_instructions(path), 10)
+
+    assert code.index.masks.nr_words > 1